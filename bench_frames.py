@@ -0,0 +1,75 @@
+import argparse
+import socket
+import threading
+import time
+
+from src import CODECS, COMPRESSORS, Key, Messanger, Util
+
+
+def _bench(mb: int, wire_format: str, compression: str):
+    client_socket, server_socket = socket.socketpair()
+    client = Messanger("client", client_socket, False)
+    server = Messanger("server", server_socket, False)
+    for messanger in (client, server):
+        messanger.use_wire_format(wire_format, compression)
+
+    # 与路径列表类似的可压缩内容
+    payload = "0123456789abcdef" * (mb * 1024 * 1024 // 16)
+    message = {Key.REQUEST_ID: "large", Key.PATH: payload}
+
+    try:
+        thread = threading.Thread(target=server.send_json, args=(message,))
+        start = time.perf_counter()
+        thread.start()
+        received = client.recv_json()
+        elapsed = time.perf_counter() - start
+        thread.join()
+    finally:
+        client.close()
+        server.close()
+
+    if not received or len(payload) != len(received[Key.PATH]):
+        Util.debug(f"{mb} MB frame: failed", fmt_indent=2)
+        return
+
+    Util.debug(
+        f"{mb} MB frame: {elapsed:.3f}s, {mb / elapsed:.1f} MB/s, "
+        f"{server.bytes_sent / 1024 / 1024:.2f} MB on wire",
+        fmt_indent=2,
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="benchmark sending large frames through Messanger"
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10, 64, 256],
+        help="frame payload sizes in MB",
+    )
+    parser.add_argument(
+        "--wire_format",
+        choices=list(CODECS),
+        default="binary",
+        help="wire format of the frames",
+    )
+    parser.add_argument(
+        "--compression",
+        choices=["none", *COMPRESSORS],
+        nargs="+",
+        default=["none", *COMPRESSORS],
+        help="compressions to compare",
+    )
+
+    return parser.parse_args()
+
+
+if "__main__" == __name__:
+    args = parse_args()
+    for compression in args.compression:
+        Util.debug(f"{args.wire_format}, compression: {compression}", fmt_time=True)
+        for mb in args.sizes:
+            _bench(mb, args.wire_format, None if "none" == compression else compression)
@@ -1,18 +1,92 @@
 import argparse
 import hashlib
+import json
+import multiprocessing
 import os
+import select
+import shutil
 import socket
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Deque, Dict, List, Optional, Tuple
 
 import yaml
 
-from src import Command, Key, Messanger, Role, Sweeper, Util
+from server import Server
+from src import (
+    SCHEDULERS,
+    Command,
+    GroupEstimate,
+    Key,
+    Messanger,
+    Partitioner,
+    Pipeline,
+    Role,
+    Sweeper,
+    Util,
+)
+
+# 每条批量查询消息包含的文件大小数量
+SIZE_BATCH = 100000
+# 每条批量查询消息包含的首块 hash 数量
+HEAD_BATCH = 1000
+
+
+class Link:
+    # 与一个服务器的连接
+    def __init__(self, address: str, messanger: Messanger, window: int):
+        self.address = address
+        self.messanger = messanger
+        self.pipeline = Pipeline(messanger, window)
+        self.delta = "delta" in messanger.features
+        self.heads = "heads" in messanger.features
+
+        # key: size, value: 服务器上该大小的文件数，本地模式下不查询
+        self.server_files: Optional[Dict[int, int]] = None
+
+
+class Probe:
+    # 一个待比较文件的状态，在等待服务器回复期间保存
+    def __init__(
+        self, *, path: str, fstat: os.stat_result, request_id: str, blocks: int
+    ):
+        self.path = path
+        self.fstat = fstat
+        self.request_id = request_id
+        self.blocks = blocks
+
+        self.fid = -1
+        self.chunk_hashes: Optional[List] = None
+        # key: 可能存在相同文件的服务器, value: 该服务器已匹配的分段数，delta 模式下只发送之后的分段
+        self.links: Dict[Link, int] = {}
+        # 第一个确认当前所有分段都匹配的回复
+        self.confirmed: Optional[Dict] = None
+        # 本轮收到的回复，所有服务器都回复后再处理
+        self.echoes: List[Tuple[Link, Dict]] = []
+        self.waiting = 0
+        self.flag_time = True
+        # 等待服务器回复期间在后台计算的下一个分段
+        self.prefetch: Optional[Future] = None
 
 
 class Scanner(Sweeper):
     def __init__(
-        self, yaml_file: str, *, local_mode: bool, debug_mode: bool, limit: Tuple
+        self,
+        yaml_file: str,
+        *,
+        local_mode: bool,
+        debug_mode: bool,
+        limit: Tuple,
+        window: int = 1,
+        in_process: bool = False,
+        partition: bool = False,
+        resume: bool = False,
+        schedule: str = "size",
+        report: str = "yaml",
+        workers: int = 1,
     ):
         super().__init__(
             Role.SCANNER,
@@ -21,33 +95,232 @@ class Scanner(Sweeper):
             debug_mode=debug_mode,
         )
 
-        self._local_mode = local_mode
+        # 进程内模式只与本机的文件比较；分桶模式不需要服务器，每个 size group 整体比较
+        self._partition = partition
+        self._in_process = in_process or partition
+        self._local_mode = local_mode or self._in_process
+        self._window = window
+        self._limit = limit
+        self._resume = resume
+        # 多进程扫描，每个 worker 处理一段连续的 size 范围
+        self._workers = max(workers, 1)
+        # worker 的传输统计和服务器地址，汇总到最终的报告
+        self._worker_traffic = [0, 0, 0, 0]
+        self._worker_server_ids: Dict[str, str] = {}
+        self._scheduler = SCHEDULERS[schedule]
+        # jsonl: 重复文件在确认时逐条写入报告，yaml 中只记录报告的路径
+        self._report_format = report
+        self._report: Optional[str] = None
+        self._report_offset: Optional[int] = None
+        self._links: List[Link] = []
+        self._ready: Deque[Probe] = deque()
+        self._connection_lost = False
         self._session_id = (
             f"{Util.random_string(3)}[{datetime.now().strftime('%H%M%S')}]"
         )
 
+        # 已经处理完成的 size group，定期写入 journal，中断后 --resume 跳过
+        self._sizes_done: List[int] = []
+        # 扫描已经开始且未全部完成，停止时保存 journal
+        self._scanning = False
+        self._journal = self._config.get("journal", None) or os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            "log",
+            f"{self._device_id}.journal.json",
+        )
+        self._checkpoint_interval = self._config.get("checkpoint_interval", 60)
+        self._checkpoint_time = time.monotonic()
+
+        # 预先计算下一个分段，磁盘读取与网络等待同时进行，0 表示不预取；
+        # 进程内的服务器在发送时同步回复，没有需要掩盖的等待，不预取
+        prefetch = 0 if self._in_process else self._config.get("prefetch_threads", 2)
+        self._prefetcher = (
+            ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix="prefetch")
+            if prefetch > 0
+            else None
+        )
+
     def start(self):
-        self._stat.group_by_size(self._sweep_dirs)
+        self._stat.group_by_size(self._sweep_dirs, db=self._db)
         self._show_sweep_dirs()
 
-        _socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        _socket.connect((self._host, self._port))
-        self._messanger = Messanger(self._device_id, _socket, self._debug_mode)
+        if self._workers > 1:
+            self._start_workers()
+        else:
+            self._scan()
 
-        # 优先处理大文件
-        for size in sorted(self._stat.size_group.keys(), reverse=True):
-            group_files = self._stat.size_group[size]
-            files = len(group_files)
+    def scan_slice(self, size_group: Dict[int, List[str]], report: Optional[str]):
+        # worker 进程中运行，只处理分配的 size group，不写 journal
+        self._stat.use_size_group(size_group)
+        self._journal = None
+        self._report = report
+        self._scan()
+
+        self._stat.close_report()
+        for link in self._links:
+            link.messanger.close()
+
+        return {
+            "stat": self._stat.checkpoint(),
+            "traffic": self._traffic(),
+            "server_ids": self._server_ids(),
+        }
+
+    def _start_workers(self):
+        if self._resume:
+            Util.debug(
+                "--resume is not supported with --workers, ignored", fmt_time=True
+            )
+
+        # 删除和扫描数量是安全上限，worker 数不超过限制，每个 worker 至少分到 1
+        limit = self._limit or (0, 0)
+        workers = min([self._workers, *[value for value in limit if value]])
+        if workers < self._workers:
+            Util.debug(
+                f"--workers reduced to {workers} by --delete/--scan limit",
+                fmt_time=True,
+            )
+
+        slices = self._slice_sizes(workers)
+        # 没有需要比较的 size group 时在当前进程中完成扫描
+        if not slices:
+            self._scan()
+            return
+
+        limits = _split_limit(limit, len(slices))
+        if "jsonl" == self._report_format:
+            self._report = self._report_path()
+
+        options = {
+            "local_mode": self._local_mode,
+            "debug_mode": self._debug_mode,
+            "window": self._window,
+            "in_process": self._in_process,
+            "partition": self._partition,
+            "schedule": self._scheduler.name,
+            "report": self._report_format,
+        }
+
+        Util.debug(f"scanning with {len(slices)} worker processes", fmt_time=True)
+        for i, sizes in enumerate(slices):
+            Util.debug(
+                f"{(i + 1):02d}: {len(sizes)} size groups [{sizes[0]}-{sizes[-1]}]",
+                fmt_indent=3,
+            )
+
+        # spawn 模式下 worker 不会继承父进程的 sqlite 连接
+        parts = []
+        with ProcessPoolExecutor(
+            max_workers=len(slices), mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = []
+            for i, sizes in enumerate(slices):
+                part = f"{self._report}.{i}" if self._report else None
+                parts.append(part)
+                futures.append(
+                    executor.submit(
+                        _scan_slice,
+                        self._yaml_file,
+                        dict(options, limit=limits[i]),
+                        {size: self._stat.size_group[size] for size in sizes},
+                        part,
+                    )
+                )
+
+            for future in futures:
+                result = future.result()
+                self._stat.merge(result["stat"])
+                for i, value in enumerate(result["traffic"]):
+                    self._worker_traffic[i] += value
+                self._worker_server_ids.update(result["server_ids"])
 
+        # 按 size 范围的顺序合并各个 worker 的报告
+        if self._report:
+            with open(self._report, "wb") as report:
+                for part in parts:
+                    if os.path.exists(part):
+                        with open(part, "rb") as f:
+                            shutil.copyfileobj(f, report)
+                        os.remove(part)
+
+    def _slice_sizes(self, workers: int) -> List[List[int]]:
+        # 按 size 排序后切分为连续的范围，每段的数据量（size * 文件数）大致相同
+        sizes = sorted(self._stat.size_group.keys())
+        total = sum(size * len(self._stat.size_group[size]) for size in sizes)
+
+        slices, current, weight = [], [], 0
+        for size in sizes:
+            current.append(size)
+            weight += size * len(self._stat.size_group[size])
+            if (
+                weight >= total * (len(slices) + 1) / workers
+                and len(slices) < workers - 1
+            ):
+                slices.append(current)
+                current = []
+        if current:
+            slices.append(current)
+
+        return slices
+
+    def _scan(self):
+        if self._in_process and not self._partition:
+            link = self._connect_in_process()
+            if link:
+                self._links.append(link)
+
+        for host, port in [] if self._in_process else self._servers:
+            link = self._connect(host, port)
+            if not link:
+                continue
+
+            # 一次性查询服务器上存在的文件大小，服务器上没有的 size group 直接跳过
             if not self._local_mode:
-                request_id = (
-                    f"{self._device_id}:{self._session_id}-size inquiry-[{size}]"
+                link.server_files = self._inquire_sizes(
+                    link.messanger, sorted(self._stat.size_group.keys())
                 )
-                if not self._compare_size(False, request_id, request_id, size):
-                    self._stat.on_scan(files)
+                if link.server_files is None:
+                    Util.debug(f"size inquiry failed: {link.address}", fmt_time=True)
+                    link.messanger.close()
                     continue
 
-            reach_limit, flg_hashed = self._shrink(group_files)
+            self._links.append(link)
+
+        if not (self._links or self._partition):
+            return
+        if self._links:
+            self._messanger = self._links[0].messanger
+
+        sizes_done = set(self._load_journal()) if self._resume else set()
+
+        if "jsonl" == self._report_format:
+            if not self._report:
+                self._report = self._report_path()
+            self._stat.open_report(self._report, offset=self._report_offset)
+
+        self._stat.mark()
+        self._scanning = True
+        for size in self._schedule():
+            if size in sizes_done:
+                continue
+
+            group_files = self._stat.size_group[size]
+            files = len(group_files)
+
+            links = [
+                link
+                for link in self._links
+                if link.server_files is None or size in link.server_files
+            ]
+            if not (links or self._partition):
+                self._stat.on_scan(files)
+                self._on_group_done(size)
+                continue
+
+            if self._partition:
+                reach_limit, flg_hashed = self._partition_group(size, group_files)
+            else:
+                reach_limit, flg_hashed = self._shrink(group_files, links)
 
             if flg_hashed:
                 Util.debug(
@@ -58,17 +331,189 @@ class Scanner(Sweeper):
             if reach_limit:
                 break
 
+            self._on_group_done(size)
+        else:
+            # 全部完成，不再需要 journal
+            self._scanning = False
+            if self._journal and os.path.exists(self._journal):
+                os.remove(self._journal)
+
     def stop(self) -> Any:
         super().stop()
+        for link in self._links:
+            link.messanger.close()
+        # 中断或达到限制时保存到最近完成的 size group
+        if self._journal and self._scanning:
+            self._checkpoint()
+        self._stat.close_report()
+        if self._prefetcher:
+            self._prefetcher.shutdown(wait=False, cancel_futures=True)
 
         return self._flush_stat()
 
-    def _shrink(self, group_files: List[str]) -> Tuple[bool, bool]:
-        flag_hashed = False
+    def _schedule(self) -> List[int]:
+        # size group 的处理顺序，本地模式下不查询服务器上的文件数
+        cached = self._db.get_hashed_bytes() if "size" != self._scheduler.name else {}
+
+        groups = []
+        for size, files in self._stat.size_group.items():
+            server_files = None
+            if not self._local_mode:
+                server_files = sum(
+                    (link.server_files or {}).get(size, 0) for link in self._links
+                )
+            groups.append(
+                GroupEstimate(
+                    size=size,
+                    files=len(files),
+                    server_files=server_files,
+                    cached=cached.get(size, 0),
+                )
+            )
+
+        Util.debug(f"size groups scheduled by {self._scheduler.name}", fmt_time=True)
+        return self._scheduler.order(groups)
+
+    def _report_path(self) -> str:
+        report = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            "log",
+            f"sweeper.{datetime.now().strftime('%Y%m%d_%H%M%S')}.duplicate.jsonl",
+        )
+        os.makedirs(os.path.dirname(report), exist_ok=True)
+
+        return report
+
+    def _on_group_done(self, size: int):
+        self._sizes_done.append(size)
+        self._stat.mark()
+
+        if (
+            self._journal
+            and time.monotonic() - self._checkpoint_time >= self._checkpoint_interval
+        ):
+            self._checkpoint()
+
+    def _checkpoint(self):
+        # 先写入临时文件再替换，中断时不会留下不完整的 journal
+        journal = {
+            "sweep_dirs": self._sweep_dirs,
+            "local_mode": self._local_mode,
+            "size": self._sizes_done[-1] if self._sizes_done else None,
+            "sizes_done": self._sizes_done,
+            "report": self._report,
+            "report_offset": self._stat.marked_report_offset,
+            "stat": self._stat.checkpoint(at_mark=True),
+        }
+
+        os.makedirs(os.path.dirname(self._journal), exist_ok=True)
+        with open(f"{self._journal}.tmp", "w", encoding="utf-8") as f:
+            json.dump(journal, f, ensure_ascii=False)
+        os.replace(f"{self._journal}.tmp", self._journal)
+
+        self._checkpoint_time = time.monotonic()
+        Util.debug(
+            f"checkpoint: {len(self._sizes_done)} size groups, {self._stat.deleted} duplicates",
+            fmt_time=True,
+        )
+
+    def _load_journal(self) -> List[int]:
+        # return value: 已经处理完成的 size group
+        if not os.path.exists(self._journal):
+            Util.debug(f"no journal to resume: {self._journal}", fmt_time=True)
+            return []
+
+        try:
+            with open(self._journal, "r", encoding="utf-8") as f:
+                journal = json.load(f)
+        except Exception:
+            traceback.print_exc()
+            return []
+
+        if (
+            journal["sweep_dirs"] != self._sweep_dirs
+            or journal["local_mode"] != self._local_mode
+            or (journal.get("report", None) is None) != ("yaml" == self._report_format)
+        ):
+            Util.debug(
+                "journal does not match the current config, ignored", fmt_time=True
+            )
+            return []
+
+        self._stat.restore(journal["stat"])
+        self._sizes_done = list(journal["sizes_done"])
+        self._report = journal.get("report", None)
+        self._report_offset = journal.get("report_offset", None)
+        Util.debug(
+            f"resumed: {len(self._sizes_done)} size groups, {self._stat.deleted} duplicates",
+            fmt_time=True,
+        )
+
+        return self._sizes_done
+
+    def _connect(self, host: str, port: int) -> Optional[Link]:
+        address = f"{host}:{port}"
+        try:
+            _socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            _socket.connect((host, port))
+        except OSError as exp:
+            Util.debug(f"connect to server {address} failed: {exp}", fmt_time=True)
+            return None
+
+        messanger = Messanger(self._device_id, _socket, self._debug_mode)
+        if not messanger.handshake(self._wire_formats, self._compressions):
+            Util.debug(f"handshake with server {address} failed", fmt_time=True)
+            messanger.close()
+            return None
+
+        return Link(address, messanger, self._window)
+
+    def _connect_in_process(self) -> Optional[Link]:
+        # 服务器与扫描端共享 size group 和 HashDB，同一个文件只遍历和计算一次
+        server = Server(
+            self._yaml_file,
+            debug_mode=self._debug_mode,
+            stat=self._stat,
+            db=self._db,
+        )
+        messanger = server.loopback(self._device_id)
+        if not messanger.handshake(self._wire_formats, self._compressions):
+            Util.debug("handshake with in-process server failed", fmt_time=True)
+            return None
+
+        return Link("in-process", messanger, self._window)
+
+    def _shrink(self, group_files: List[str], links: List[Link]) -> Tuple[bool, bool]:
+        self._flag_hashed = False
+
+        # 服务器都支持时按批比较首块 hash，之后只有候选文件逐个比较
+        batch = all(link.heads for link in links)
+        heads = {}
+
+        files = sorted(group_files)
+        batch_end = 0
+        for i, path in enumerate(files):
+            # 窗口已满时先处理服务器的回复
+            if not self._pump(drain=False):
+                return True, self._flag_hashed
 
-        for path in sorted(group_files):
             if self._stat.reach_limit():
-                return True, flag_hashed
+                self._pump(drain=True)
+                return True, self._flag_hashed
+
+            # 每批只包含扫描数量限制以内、不会被跳过的文件
+            if batch and i >= batch_end:
+                batch_end = i + min(HEAD_BATCH, self._stat.scan_left or HEAD_BATCH)
+                heads = self._inquire_heads(
+                    [
+                        file
+                        for file in files[i:batch_end]
+                        if not (self._local_mode and self._stat.skip_scan(file))
+                    ],
+                    links,
+                )
+                if heads is None:
+                    return True, self._flag_hashed
 
             self._stat.on_scan()
 
@@ -83,123 +528,457 @@ class Scanner(Sweeper):
             if not fstat:
                 continue
 
-            request_id = f"{self._device_id}-{path}"
-            request_id = (
-                hashlib.md5(request_id.encode("utf-8")).hexdigest()
-                + f"-{self._session_id}"
+            probe = Probe(
+                path=path,
+                fstat=fstat,
+                request_id=self._request_id(path),
+                blocks=self._ch.blocks(fstat.st_size),
+            )
+
+            if batch:
+                self._on_head(probe, heads.get(path, None))
+            # 非本地模式下 size group 已经确认过服务器上存在相同大小的文件
+            elif self._local_mode:
+                self._compare_size(probe, links)
+            else:
+                probe.links = {link: 0 for link in links}
+                self._ready.append(probe)
+
+        return not self._pump(drain=True), self._flag_hashed
+
+    def _partition_group(self, size: int, group_files: List[str]) -> Tuple[bool, bool]:
+        if self._stat.reach_limit():
+            return True, False
+
+        # 只比较扫描数量限制以内的文件
+        files = sorted(group_files)
+        scan_left = self._stat.scan_left
+        reach_limit = scan_left is not None and scan_left < len(files)
+        if reach_limit:
+            files = files[:scan_left]
+        self._stat.on_scan(len(files))
+
+        # key: path, value: (fid, 数据库中已有的分段数, {serial: 分段 hash})，读取失败时为 None
+        self._chunks: Dict[str, Optional[Tuple[int, int, Dict[int, Dict]]]] = {}
+        partitioner = Partitioner(self._ch.blocks(size), self._block_hash)
+
+        for bucket in partitioner.split(files):
+            chunks = self._chunks[bucket[0]][2]
+            chunk_hashes = [chunks[serial] for serial in sorted(chunks)]
+
+            for path in bucket[1:]:
+                if self._stat.reach_limit(scan=False):
+                    reach_limit = True
+                    break
+
+                if self._stat.on_duplicate(
+                    server_id=self._device_id,
+                    server_path=bucket[0],
+                    chunk_hashes=chunk_hashes,
+                    client_path=path,
+                    free_space=size,
+                    local_mode=True,
+                ):
+                    Util.debug(f"{os.path.basename(path)}{'-' * 5}COPY", fmt_time=True)
+
+            # 达到删除数量的限制后不再比较其余的桶，在 split 计算下一个桶之前停止
+            if self._stat.reach_limit(scan=False):
+                reach_limit = True
+                break
+
+        # 分段按顺序保存，尾块等中间分段计算完成后才写入
+        for path, chunk in self._chunks.items():
+            if chunk:
+                self._save_chunks(path, *chunk)
+
+        return reach_limit, len(self._chunks) > 0
+
+    def _block_hash(self, path: str, serial: int) -> Optional[str]:
+        if path not in self._chunks:
+            self._chunks[path] = None
+
+            fstat = Util.stat(path)
+            fid, chunk_hashes = (
+                self._file_details(
+                    path=path,
+                    size=fstat.st_size,
+                    mtime=fstat.st_mtime,
+                    request_id=self._request_id(path),
+                )
+                if fstat
+                else (-1, None)
+            )
+            if not chunk_hashes:
+                self._record_file_with_error(path)
+                return None
+
+            self._chunks[path] = (
+                fid,
+                len(chunk_hashes),
+                {chunk["serial"]: chunk for chunk in chunk_hashes},
+            )
+
+        if not self._chunks[path]:
+            return None
+
+        chunks = self._chunks[path][2]
+        if serial not in chunks:
+            hash, block_size = self._ch.block_hash(path=path, serial=serial)
+            if not hash:
+                self._record_file_with_error(path)
+                self._chunks[path] = None
+                return None
+
+            self._stat.on_hash(block_size)
+            chunks[serial] = {"serial": serial, "block_size": block_size, "hash": hash}
+
+        return chunks[serial]["hash"]
+
+    def _save_chunks(self, path: str, fid: int, stored: int, chunks: Dict[int, Dict]):
+        hashes = []
+        serial = stored + 1
+        while serial in chunks:
+            chunk = chunks[serial]
+            hashes.append((serial, chunk["block_size"], chunk["hash"]))
+            serial += 1
+
+        if -1 != fid and hashes and self._db.add_chunk_hashes(fid=fid, hashes=hashes):
+            Util.debug(
+                f"{os.path.basename(path)}-[{stored + 1:02d}-{serial - 1:02d}]",
+                fmt_indent=9,
             )
 
-            if not self._compare_size(
-                self._local_mode, request_id, path, fstat.st_size
+    def _request_id(self, path: str) -> str:
+        request_id = f"{self._device_id}-{path}"
+
+        return (
+            hashlib.md5(request_id.encode("utf-8")).hexdigest() + f"-{self._session_id}"
+        )
+
+    def _inquire_heads(
+        self, files: List[str], links: List[Link]
+    ) -> Optional[Dict[str, Tuple]]:
+        # return value {path: (fid, chunk_hashes, {link: server path})}，只包含有候选文件的文件
+        hashed, size = [], 0
+        for path in files:
+            fstat = Util.stat(path)
+            if not fstat:
+                continue
+            size = fstat.st_size
+
+            fid, chunk_hashes = self._file_details(
+                path=path,
+                size=fstat.st_size,
+                mtime=fstat.st_mtime,
+                request_id=self._request_id(path),
+            )
+            if not chunk_hashes:
+                self._record_file_with_error(path)
+                continue
+
+            hashed.append((path, fid, chunk_hashes))
+            self._flag_hashed = True
+
+        if not hashed:
+            return {}
+
+        # 等待之前的请求完成，回复按到达顺序记录
+        if not self._pump(drain=True):
+            return None
+
+        echoes: List[Tuple[Link, Dict]] = []
+        msg = self._msg_builder.req_heads(
+            device_id=self._device_id,
+            request_id=f"{self._device_id}:{self._session_id}-heads-{hashed[0][0]}",
+            local_mode=self._local_mode,
+            size=size,
+            chunk_hashes=[chunk_hashes[0] for _, _, chunk_hashes in hashed],
+            paths=[path for path, _, _ in hashed] if self._local_mode else None,
+        )
+        for link in links:
+            if not link.pipeline.send(
+                msg, lambda echo, link=link: echoes.append((link, echo))
+            ):
+                self._connection_lost = True
+                return None
+
+        if not self._pump(drain=True):
+            return None
+
+        heads = {}
+        for link, echo_message in echoes:
+            if not (
+                isinstance(echo_message.get(Key.RESULT, None), list)
+                and Command.ECHO_CHECK_HEADS == echo_message.get(Key.COMMAND, None)
             ):
+                Util.debug(
+                    f"unexpected echo message [{str(echo_message)}]", fmt_time=True
+                )
                 continue
 
-            self._compare_hash(request_id, path, fstat)
-            flag_hashed = True
+            for i, server_path in echo_message[Key.RESULT]:
+                path, fid, chunk_hashes = hashed[i]
+                heads.setdefault(path, (fid, chunk_hashes, {}))[2][link] = server_path
 
-        return False, flag_hashed
+        return heads
 
-    def _compare_size(
-        self,
-        local_mode,
-        request_id,
-        path: str,
-        size: int,
-    ) -> bool:
+    def _on_head(self, probe: "Probe", head: Optional[Tuple]):
+        # unique file found
+        if not head:
+            return
+
+        probe.fid, probe.chunk_hashes, found = head
+
+        # 只有一个分段，首块 hash 相同即为重复文件
+        if 1 == probe.blocks:
+            link, server_path = next(iter(found.items()))
+            self._record_duplicate(probe, link.messanger.peer_id, server_path)
+            return
+
+        probe.links = {link: 0 for link in found}
+        self._ready.append(probe)
+
+    def _pump(self, *, drain: bool) -> bool:
+        # 推进已收到回复的文件，直到窗口有空位（drain 时直到所有请求完成）
+        while not self._connection_lost:
+            while self._ready:
+                self._step(self._ready.popleft())
+
+            busy = [link for link in self._links if link.pipeline.pending > 0]
+            if not (
+                any(link.pipeline.full for link in self._links) or (drain and busy)
+            ):
+                return True
+
+            # 只接收已经到达的回复，避免等待较慢的服务器
+            readable = [link.messanger for link in busy if link.messanger.buffered]
+            if not readable:
+                readable, _, _ = select.select(
+                    [link.messanger for link in busy], [], []
+                )
+            for messanger in readable:
+                link = next(link for link in busy if link.messanger is messanger)
+                if not link.pipeline.poll():
+                    self._connection_lost = True
+
+        Util.debug("connection to server lost", fmt_time=True)
+        return False
+
+    def _compare_size(self, probe: "Probe", links: List[Link]):
         msg = self._msg_builder.req_size(
             device_id=self._device_id,
-            request_id=request_id,
-            local_mode=local_mode,
-            path=path,
-            size=size,
+            request_id=probe.request_id,
+            local_mode=self._local_mode,
+            path=probe.path,
+            size=probe.fstat.st_size,
         )
-        if not self._messanger.send_json(msg):
-            return False
 
-        echo_message = self._messanger.recv_json()
+        # 先设置等待数，发送时可能已经收到其他服务器的回复
+        probe.waiting = len(links)
+        for link in links:
+            if not link.pipeline.send(
+                msg, lambda echo, link=link: self._on_echo_size(probe, link, echo)
+            ):
+                self._connection_lost = True
+                return
+
+    def _on_echo_size(self, probe: "Probe", link: Link, echo_message: Dict):
+        probe.waiting -= 1
+
         if not (
-            echo_message
-            and Key.RESULT in echo_message
+            Key.RESULT in echo_message
             and Command.ECHO_CHECK_SIZE == echo_message.get(Key.COMMAND, None)
-            and request_id == echo_message.get(Key.REQUEST_ID, None)
-            and size == echo_message.get(Key.SIZE, -1)
+            and probe.fstat.st_size == echo_message.get(Key.SIZE, -1)
         ):
             Util.debug("unexpected echo message", fmt_indent=3, fmt_time=True)
-            return False
+        elif echo_message[Key.RESULT] > 0:
+            probe.links[link] = 0
+
+        if 0 == probe.waiting and probe.links:
+            self._ready.append(probe)
 
-        return echo_message[Key.RESULT] > 0
+    def _inquire_sizes(
+        self, messanger: Messanger, sizes: List[int]
+    ) -> Optional[Dict[int, int]]:
+        # return value {size: files on server}
+        server_files = {}
 
-    def _compare_hash(self, request_id, path: str, fstat: os.stat_result):
-        fid, chunk_hashes = self._file_details(
-            path=path, size=fstat.st_size, mtime=fstat.st_mtime, request_id=request_id
+        for i in range(0, len(sizes), SIZE_BATCH):
+            request_id = f"{self._device_id}:{self._session_id}-size inquiry-[{i}]"
+            batch = sizes[i : i + SIZE_BATCH]
+
+            msg = self._msg_builder.req_sizes(
+                device_id=self._device_id, request_id=request_id, sizes=batch
+            )
+            if not messanger.send_json(msg):
+                return None
+
+            echo_message = messanger.recv_json()
+            if not (
+                echo_message
+                and Key.RESULT in echo_message
+                and Command.ECHO_CHECK_SIZES == echo_message.get(Key.COMMAND, None)
+                and request_id == echo_message.get(Key.REQUEST_ID, None)
+            ):
+                Util.debug("unexpected echo message", fmt_indent=3, fmt_time=True)
+                return None
+
+            for size, files in echo_message[Key.RESULT]:
+                if files > 0:
+                    server_files[size] = files
+
+        Util.debug(
+            f"{len(server_files)} of {len(sizes)} size groups found on server {messanger.peer_id}",
+            fmt_time=True,
         )
-        if not chunk_hashes:
-            self._record_file_with_error(path)
-            return
 
-        flag_time = True
-        blocks = self._ch.blocks(fstat.st_size)
-        while True:
-            # check chunk hashes
-            error, echo_message = self._check_chunk_hashes(
-                self._msg_builder.req_hash(
-                    device_id=self._device_id,
-                    request_id=request_id,
-                    local_mode=self._local_mode,
-                    path=path,
-                    size=fstat.st_size,
-                    chunk_hashes=chunk_hashes,
-                ),
+        return server_files
+
+    def _step(self, probe: "Probe"):
+        echoes, probe.echoes = probe.echoes, []
+
+        if probe.chunk_hashes is None:
+            fid, chunk_hashes = self._file_details(
+                path=probe.path,
+                size=probe.fstat.st_size,
+                mtime=probe.fstat.st_mtime,
+                request_id=probe.request_id,
             )
-            # unique file found or error
-            if error or echo_message[Key.RESULT] is None:
-                break
+            if not chunk_hashes:
+                self._record_file_with_error(probe.path)
+                return
+
+            probe.fid, probe.chunk_hashes = fid, chunk_hashes
+            self._flag_hashed = True
+        else:
+            for link, echo_message in echoes:
+                if echo_message.get(Key.RESYNC, False):
+                    # 服务器丢失了已匹配的分段，重发完整列表
+                    probe.links[link] = 0
+                elif echo_message[Key.RESULT] is None:
+                    probe.links.pop(link, None)
+                else:
+                    probe.links[link] = len(probe.chunk_hashes)
+                    if not probe.confirmed:
+                        probe.confirmed = echo_message
+
+            # unique file found
+            if not probe.links:
+                self._discard_prefetch(probe)
+                return
+
+            # 需要重发的服务器确认之前不计算下一个分段
+            stale = [
+                link
+                for link, matched in probe.links.items()
+                if matched < len(probe.chunk_hashes)
+            ]
+            if stale:
+                self._compare_hash(probe, stale)
+                return
 
             # no more chunk
-            if len(chunk_hashes) == blocks:
-                if self._stat.on_duplicate(
-                    server_id=echo_message[Key.DEVICE_ID],
-                    server_path=echo_message[Key.RESULT],
-                    chunk_hashes=chunk_hashes,
-                    client_path=path,
-                    free_space=fstat.st_size,
-                    local_mode=self._local_mode,
-                ):
-                    Util.debug(
-                        f"{os.path.basename(path)}{'-' * 5}COPY",
-                        fmt_indent=(0 if flag_time else 9),
-                        fmt_time=flag_time,
-                    )
-                break
+            if len(probe.chunk_hashes) == probe.blocks:
+                self._record_duplicate(
+                    probe, probe.confirmed[Key.DEVICE_ID], probe.confirmed[Key.RESULT]
+                )
+                return
 
-            # update next chunk
-            flag_time = False
-            if not self._update_next_chunk(fid, path, chunk_hashes):
-                break
+            # update next chunk，每个分段只计算一次，发送给所有服务器
+            probe.flag_time = False
+            prefetch, probe.prefetch = probe.prefetch, None
+            if not self._update_next_chunk(
+                probe.fid, probe.path, probe.chunk_hashes, prefetch
+            ):
+                return
+            probe.confirmed = None
+
+        self._compare_hash(probe, list(probe.links))
 
-    def _check_chunk_hashes(self, msg: Dict) -> Tuple[bool, Optional[Dict]]:
-        # return value (error_flag, echo_message)
-        if not self._messanger.send_json(msg):
-            return True, None
+    def _compare_hash(self, probe: "Probe", links: List[Link]):
+        self._prefetch(probe)
+
+        # 先设置等待数，发送时可能已经收到其他服务器的回复
+        probe.waiting = len(links)
+        for link in links:
+            matched = probe.links[link] if link.delta else 0
+            msg = self._msg_builder.req_hash(
+                device_id=self._device_id,
+                request_id=probe.request_id,
+                local_mode=self._local_mode,
+                path=probe.path,
+                size=probe.fstat.st_size,
+                chunk_hashes=probe.chunk_hashes[matched:],
+                delta=matched > 0,
+            )
+            if not link.pipeline.send(
+                msg, lambda echo, link=link: self._on_echo_hash(probe, link, echo)
+            ):
+                self._connection_lost = True
+                return
+
+    def _prefetch(self, probe: "Probe"):
+        serial = len(probe.chunk_hashes) + 1
+        if self._prefetcher and not probe.prefetch and serial <= probe.blocks:
+            probe.prefetch = self._prefetcher.submit(
+                self._ch.block_hash, path=probe.path, serial=serial
+            )
+
+    def _discard_prefetch(self, probe: "Probe"):
+        # 服务器确认文件唯一，已经开始的计算结果直接丢弃
+        if probe.prefetch:
+            probe.prefetch.cancel()
+            probe.prefetch = None
+
+    def _on_echo_hash(self, probe: "Probe", link: Link, echo_message: Dict):
+        probe.waiting -= 1
 
-        echo_message = self._messanger.recv_json()
         if not (
-            echo_message
-            and Key.RESULT in echo_message
+            Key.RESULT in echo_message
             and Command.ECHO_CHECK_HASH == echo_message.get(Key.COMMAND, None)
-            and msg[Key.REQUEST_ID] == echo_message.get(Key.REQUEST_ID, None)
         ):
-            info = "unexpected echo message"
-            if echo_message:
-                info += f" [{str(echo_message)}]"
-            Util.debug(info, fmt_time=True)
-            return True, None
+            Util.debug(f"unexpected echo message [{str(echo_message)}]", fmt_time=True)
+            probe.links.pop(link, None)
+        else:
+            probe.echoes.append((link, echo_message))
 
-        return False, echo_message
+        if 0 == probe.waiting:
+            self._ready.append(probe)
 
-    def _update_next_chunk(self, fid: int, path: str, chunk_hashes: List) -> bool:
+    def _record_duplicate(self, probe: "Probe", server_id: str, server_path: str):
+        if self._stat.on_duplicate(
+            server_id=server_id,
+            server_path=server_path,
+            chunk_hashes=probe.chunk_hashes,
+            client_path=probe.path,
+            free_space=probe.fstat.st_size,
+            local_mode=self._local_mode,
+        ):
+            Util.debug(
+                f"{os.path.basename(probe.path)}{'-' * 5}COPY",
+                fmt_indent=(0 if probe.flag_time else 9),
+                fmt_time=probe.flag_time,
+            )
+
+    def _update_next_chunk(
+        self, fid: int, path: str, chunk_hashes: List, prefetch: Future = None
+    ) -> bool:
         serial = len(chunk_hashes) + 1
-        hash, block_size = self._ch.block_hash(path=path, serial=serial)
+
+        # 进程内的服务器与扫描端共享 HashDB，比较其他文件时可能已经计算过该分段
+        if self._in_process and -1 != fid:
+            stored = self._db.get_chunk_hashes(fid)
+            if len(stored) >= serial and serial == stored[serial - 1]["serial"]:
+                if prefetch:
+                    prefetch.cancel()
+                chunk_hashes.append(stored[serial - 1])
+                return True
+
+        hash, block_size = (
+            prefetch.result()
+            if prefetch
+            else self._ch.block_hash(path=path, serial=serial)
+        )
         if not hash:
             self._record_file_with_error(path)
             return False
@@ -219,6 +998,25 @@ class Scanner(Sweeper):
 
         Util.debug(f"!!! {os.path.basename(path)}", fmt_time=True)
 
+    def _traffic(self) -> List[int]:
+        # [发送字节数, 发送的消息字节数, 接收字节数, 接收的消息字节数]
+        traffic = list(self._worker_traffic)
+        for link in self._links:
+            messanger = link.messanger
+            traffic[0] += messanger.bytes_sent
+            traffic[1] += messanger.payload_sent
+            traffic[2] += messanger.bytes_received
+            traffic[3] += messanger.payload_received
+
+        return traffic
+
+    def _server_ids(self) -> Dict[str, str]:
+        server_ids = dict(self._worker_server_ids)
+        for link in self._links:
+            server_ids[link.messanger.peer_id] = link.address
+
+        return server_ids
+
     def _flush_stat(self) -> str:
         f_stat = f"sweeper.{datetime.now().strftime('%Y%m%d_%H%M%S')}.yaml"
         f_stat = os.path.join(os.path.dirname(os.path.abspath(__file__)), "log", f_stat)
@@ -231,11 +1029,27 @@ class Scanner(Sweeper):
                 f"{Util.readable_size(self._stat.shrink_bytes)} from {self._stat.deleted} files"
             )
             stat["hashed"] = f"{Util.readable_size(self._stat.hash_bytes)}"
+            if not self._in_process and (self._links or self._worker_server_ids):
+                # 实际传输字节数（压缩前的消息字节数）
+                sent, payload_sent, received, payload_received = self._traffic()
+                stat["sent"] = (
+                    f"{Util.readable_size(sent)} ({Util.readable_size(payload_sent)})"
+                )
+                stat["received"] = (
+                    f"{Util.readable_size(received)} ({Util.readable_size(payload_received)})"
+                )
             yaml.dump(
                 {
                     "id": self._device_id,
                     "local_mode": self._local_mode,
-                    "server": f"{self._host}:{self._port}",
+                    "in_process": self._in_process,
+                    "server": (
+                        f"{self._host}:{self._port}"
+                        if 1 == len(self._servers)
+                        else [f"{host}:{port}" for host, port in self._servers]
+                    ),
+                    # 重复文件记录中的服务器 id 对应的地址
+                    "server_ids": self._server_ids(),
                     "sweep_dirs": [
                         "*** absolute path in which duplicate files will be deleted ***"
                     ],
@@ -245,7 +1059,11 @@ class Scanner(Sweeper):
                     "file_extensions": sorted(self._stat.extensions),
                     "error": self._stat.files_error,
                     "blank": self._stat.files_0bytes,
-                    "duplicate": self._stat.files_duplicate,
+                    **(
+                        {"duplicate_report": self._report}
+                        if self._report
+                        else {"duplicate": self._stat.files_duplicate}
+                    ),
                 },
                 f,
                 allow_unicode=True,
@@ -256,6 +1074,24 @@ class Scanner(Sweeper):
         return f_stat
 
 
+def _scan_slice(
+    yaml_file: str, options: Dict, size_group: Dict[int, List[str]], report: str
+) -> Dict:
+    # worker 进程的入口
+    return Scanner(yaml_file, **options).scan_slice(size_group, report)
+
+
+def _split_limit(limit: Tuple, parts: int) -> List[Tuple]:
+    # 每个限制按 parts 份分配，余数分给前面的 worker，各份之和等于原来的限制
+    return [
+        tuple(
+            (value // parts + (1 if i < value % parts else 0)) if value else 0
+            for value in limit
+        )
+        for i in range(parts)
+    ]
+
+
 def check_max(value):
     _max = int(value)
     if _max < 0:
@@ -289,6 +1125,13 @@ def parse_args():
         help="max number of files to scan",
     )
 
+    parser.add_argument(
+        "--window",
+        type=check_max,
+        default=1,
+        help="max number of requests in flight to the server, 1 means lock-step",
+    )
+
     parser.add_argument(
         "--local",
         action="store_true",
@@ -296,6 +1139,48 @@ def parse_args():
         help="client & server running on local mode, don't compare the same path file",
     )
 
+    parser.add_argument(
+        "--in-process",
+        action="store_true",
+        default=False,
+        help="run the local mode server in the same process, implies --local",
+    )
+
+    parser.add_argument(
+        "--partition",
+        action="store_true",
+        default=False,
+        help="compare each size group as a whole without server, head, tail & other blocks in turn, implies --in-process",
+    )
+
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="skip the size groups finished by the last interrupted run",
+    )
+
+    parser.add_argument(
+        "--schedule",
+        choices=sorted(SCHEDULERS),
+        default="size",
+        help="order of size groups: size (larger first) or reclaim (expected space freed per byte hashed)",
+    )
+
+    parser.add_argument(
+        "--report",
+        choices=["yaml", "jsonl"],
+        default="yaml",
+        help="write duplicates into the yaml log at exit, or append them to a jsonl report as they are found",
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=check_max,
+        default=1,
+        help="number of scanner processes, each scans a disjoint range of file sizes with its own connection",
+    )
+
     parser.add_argument(
         "--debug",
         action="store_true",
@@ -315,6 +1200,13 @@ if "__main__" == __name__:
             local_mode=args.local,
             debug_mode=args.debug,
             limit=(args.delete, args.scan),
+            window=args.window,
+            in_process=args.in_process,
+            partition=args.partition,
+            resume=args.resume,
+            schedule=args.schedule,
+            report=args.report,
+            workers=args.workers,
         )
         scanner.start()
     except KeyboardInterrupt:
@@ -1,25 +1,180 @@
 import argparse
+import asyncio
+import contextlib
 import os
 import socket
-from typing import Dict, List
+import sys
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from src import (
+    BLOCK_SIZE,
+    CODECS,
+    COMPRESSORS,
+    FEATURES,
+    HEAD_SIZE,
+    AsyncMessanger,
+    Command,
+    DirWatcher,
+    HashDB,
+    HeadIndex,
+    Key,
+    LoopbackMessanger,
+    Messanger,
+    PreHasher,
+    Role,
+    SessionCache,
+    ShrinkStat,
+    Sweeper,
+    Util,
+)
+
+# 一个分段 hash 估算占用的内存
+CHUNK_NBYTES = sys.getsizeof(
+    {"serial": 1, "block_size": 1, "hash": "0" * 32}
+) + sys.getsizeof("0" * 32)
+
+
+class Client:
+    # 一个客户端连接
+    def __init__(self, messanger: Messanger):
+        self.messanger = messanger
+
+
+class Session:
+    # 一个 request_id 的比较状态，被淘汰后可以由 size group 重建
+    def __init__(self, files: Optional[List[str]]):
+        # 待比较的文件列表
+        self.files = files
+        # (已匹配的文件, 已匹配的分段 hash)，用于 delta 请求
+        self.matched: Optional[Tuple[str, List]] = None
+
+        # 文件列表只会缩短，按创建时估算
+        self._files_nbytes = sys.getsizeof(files) + sum(
+            sys.getsizeof(path) for path in files or []
+        )
+
+    def nbytes(self) -> int:
+        nbytes = sys.getsizeof(self) + self._files_nbytes
+        if self.matched:
+            nbytes += len(self.matched[1]) * CHUNK_NBYTES
 
-from src import Command, Key, Messanger, Role, Sweeper, Util
+        return nbytes
 
 
 class Server(Sweeper):
-    def __init__(self, yaml_file: str, *, debug_mode: bool):
+    def __init__(
+        self,
+        yaml_file: str,
+        *,
+        debug_mode: bool,
+        watch_mode: bool = False,
+        async_mode: bool = False,
+        stat: ShrinkStat = None,
+        db: HashDB = None,
+    ):
         super().__init__(Role.SERVER, yaml_file, debug_mode=debug_mode)
 
+        # 与扫描端在同一进程中运行时共享 size group 和 HashDB
+        if stat:
+            self._stat = stat
+        if db:
+            self._db.close()
+            self._db = db
+
+        self._watch_mode = watch_mode
+        self._async_mode = async_mode
+        # 保护 size group，目录监控线程会修改
+        self._lock = threading.RLock()
+
+        # key: request_id, value: Session，所有连接共享
+        self._sessions = SessionCache(
+            max_entries=self._config.get("session_entries", 100000),
+            max_bytes=self._config.get("session_memory", 256) * 1024 * 1024,
+            ttl=self._config.get("session_ttl", 3600),
+            sizeof=Session.nbytes,
+        )
+        # 新会话只包含首块 hash 相同的文件；没有 --watch 时原地改写且大小不变的文件
+        # 只在作为候选文件再次比较时重新索引
+        self._index = HeadIndex()
+        self._prehasher: PreHasher = None
+        # key: path, value: [Lock, 等待数]，同一个文件的分段 hash 查询和计算串行执行
+        self._file_locks: Dict[str, List] = {}
+        self._file_locks_guard = threading.Lock()
+
+        # 匹配成功后在后台预先计算候选文件的下一个分段，speculate_budget 为同时预计算的 MB 数，
+        # 0 表示关闭；共享扫描端的 HashDB 时连接不能跨线程使用，不预计算
+        budget = 0 if db else self._config.get("speculate_budget", 256)
+        self._speculate_budget = budget * 1024 * 1024
+        self._speculate_bytes = 0
+        # key: path, value: 正在计算下一个分段的 Future
+        self._speculations: Dict[str, Future] = {}
+        self._speculate_lock = threading.Lock()
+        self._speculator = (
+            ThreadPoolExecutor(
+                max_workers=self._config.get("speculate_threads", 2),
+                thread_name_prefix="speculate",
+            )
+            if budget > 0
+            else None
+        )
+
     def start(self):
-        self._stat.group_by_size(self._sweep_dirs)
+        self._stat.group_by_size(self._sweep_dirs, db=self._db)
         self._show_sweep_dirs()
 
+        # 空闲时预先计算首块 hash，warmup_rate 为每秒读取的 MB 数，0 表示不限制
+        warm_up = self._config.get("warmup", True)
+        if warm_up or self._watch_mode:
+            self._prehasher = PreHasher(
+                self._db_path,
+                debug_mode=self._debug_mode,
+                rate=self._config.get("warmup_rate", 20) * 1024 * 1024,
+                on_hashed=self._on_prehashed,
+                file_lock=self._file_lock,
+            )
+            self._prehasher.start()
+
+        if warm_up:
+            with self._lock:
+                size_group = {
+                    size: list(files) for size, files in self._stat.size_group.items()
+                }
+            self._prehasher.warm_up(size_group)
+
+        if self._watch_mode:
+            self._start_watch()
+
+        if self._async_mode:
+            asyncio.run(self._serve_async())
+        else:
+            self._serve()
+
+    def loopback(self, device_id: str) -> LoopbackMessanger:
+        # 进程内的连接，不需要 start()，请求在调用方线程中处理
+        client = Client(None)
+        client.messanger = LoopbackMessanger(
+            device_id,
+            lambda request: self._dispatch(request, client),
+            self._debug_mode,
+        )
+
+        return client.messanger
+
+    def stop(self) -> Any:
+        if self._speculator:
+            self._speculator.shutdown(wait=False, cancel_futures=True)
+
+        return super().stop()
+
+    def _serve(self):
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.bind((self._host, self._port))
             s.listen(1)
 
             while True:
-                self._session = {}
                 csocket, caddress = s.accept()
                 Util.debug(f"client connected: {caddress}", fmt_time=True)
                 self._handle_request(csocket)
@@ -28,62 +183,297 @@ class Server(Sweeper):
         if self._messanger:
             self._messanger.close()
         self._messanger = Messanger(self._device_id, _socket, self._debug_mode)
+        client = Client(self._messanger)
 
         while True:
             request = self._messanger.recv_json()
             if not request:
                 break
 
-            if request[Key.COMMAND] == Command.CHECK_SIZE:
-                self._handle_req_size(request)
-            elif request[Key.COMMAND] == Command.CHECK_HASH:
-                self._handle_req_chunk_hash(request)
-            elif request[Key.COMMAND] == Command.CALC_FILE_HASH:
-                self._handle_req_file_hash(request)
-            else:
+            reply = self._dispatch(request, client)
+            if not reply:
                 self._messanger.close()
                 self._messanger = None
                 break
 
-    def _handle_req_size(self, request: Dict):
+            self._messanger.send_json(reply)
+            self._on_replied(client, reply)
+
+        self._show_session_stat()
+
+    async def _serve_async(self):
+        # 每个连接一个 task，hash 计算在 executor 中进行，慢速磁盘不会阻塞其他客户端
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._config.get("workers", 8),
+            thread_name_prefix="sweeper",
+        )
+        server = await asyncio.start_server(self._handle_client, self._host, self._port)
+        Util.debug(f"serving on {self._host}:{self._port} [asyncio]", fmt_time=True)
+
+        async with server:
+            await server.serve_forever()
+
+    async def _handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        caddress = writer.get_extra_info("peername")
+        Util.debug(f"client connected: {caddress}", fmt_time=True)
+
+        messanger = AsyncMessanger(self._device_id, reader, writer, self._debug_mode)
+        client = Client(messanger)
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                request = await messanger.recv_json()
+                if not request:
+                    break
+
+                reply = await loop.run_in_executor(
+                    self._executor, self._dispatch, request, client
+                )
+                if not reply or not await messanger.send_json(reply):
+                    break
+
+                self._on_replied(client, reply)
+        finally:
+            messanger.close()
+            Util.debug(f"client disconnected: {caddress}", fmt_time=True)
+            self._show_session_stat()
+
+    def _dispatch(self, request: Dict, client: Client) -> Optional[Dict]:
+        # 返回回复消息，未知命令返回 None；处理期间后台 hash 暂停
+        with self._prehasher.hold() if self._prehasher else contextlib.nullcontext():
+            if request[Key.COMMAND] == Command.HELLO:
+                return self._handle_req_hello(request)
+            elif request[Key.COMMAND] == Command.CHECK_SIZE:
+                return self._handle_req_size(request)
+            elif request[Key.COMMAND] == Command.CHECK_SIZES:
+                return self._handle_req_sizes(request)
+            elif request[Key.COMMAND] == Command.CHECK_HEADS:
+                return self._handle_req_heads(request)
+            elif request[Key.COMMAND] == Command.CHECK_HASH:
+                return self._handle_req_chunk_hash(request)
+            elif request[Key.COMMAND] == Command.CALC_FILE_HASH:
+                return self._handle_req_file_hash(request)
+
+        return None
+
+    def _on_replied(self, client: Client, reply: Dict):
+        # HELLO 的回复仍使用握手前的编码，之后切换
+        if Command.ECHO_HELLO == reply[Key.COMMAND]:
+            client.messanger.use_wire_format(reply[Key.RESULT], reply[Key.COMPRESSION])
+
+    def _start_watch(self):
+        self._stat.track()
+
+        self._watcher = DirWatcher.create(
+            self._sweep_dirs,
+            self._on_path_changed,
+            interval=self._config.get("watch_interval", 60),
+        )
+        self._watcher.start()
+        Util.debug(
+            f"watching sweep directories: {type(self._watcher).__name__}",
+            fmt_time=True,
+        )
+
+    def _on_prehashed(self, path: str, size: int, hash: str):
+        self._index.add(size, path, hash)
+
+    def _on_path_changed(self, path: str):
+        with self._lock:
+            updated, removed = self._stat.refresh(path)
+
+        for file in updated:
+            self._index.discard(file)
+            fstat = Util.stat(file)
+            if fstat:
+                self._index.invalidate(fstat.st_size)
+
+            self._prehasher.submit(file)
+            if self._debug_mode:
+                Util.debug(f"+ {file}", fmt_indent=9)
+
+        for file in removed:
+            self._index.discard(file)
+            self._prehasher.discard(file)
+            if self._debug_mode:
+                Util.debug(f"- {file}", fmt_indent=9)
+
+    def _handle_req_hello(self, request: Dict) -> Dict:
+        wire_format = "json"
+        for candidate in request.get(Key.WIRE_FORMAT, None) or []:
+            if candidate in CODECS:
+                wire_format = candidate
+                break
+
+        compression = None
+        for candidate in request.get(Key.COMPRESSION, None) or []:
+            if candidate in COMPRESSORS:
+                compression = candidate
+                break
+
+        Util.debug(
+            f"client {request[Key.DEVICE_ID]} wire format: {wire_format}, compression: {compression}",
+            fmt_time=True,
+        )
+
+        return self._msg_builder.echo_hello(
+            device_id=self._device_id,
+            request_id=request[Key.REQUEST_ID],
+            wire_format=wire_format,
+            compression=compression,
+            features=[
+                feature
+                for feature in request.get(Key.FEATURES, None) or []
+                if feature in FEATURES
+            ],
+        )
+
+    def _handle_req_size(self, request: Dict) -> Dict:
         result = 0
 
         size = request[Key.SIZE]
-        files = self._stat.size_group.get(size, None)
-        if files:
-            result = len(files)
-            if request[Key.LOCAL_MODE] and request[Key.PATH] in files:
-                result -= 1
-
-        msg = self._msg_builder.echo_size(
+        with self._lock:
+            files = self._stat.size_group.get(size, None)
+            if files:
+                result = len(files)
+                if request[Key.LOCAL_MODE] and request[Key.PATH] in files:
+                    result -= 1
+
+        return self._msg_builder.echo_size(
             device_id=self._device_id,
             request_id=request[Key.REQUEST_ID],
             size=size,
             files=result,
         )
-        self._messanger.send_json(msg)
 
-    def _handle_req_chunk_hash(self, request: Dict):
+    def _handle_req_sizes(self, request: Dict) -> Dict:
+        files = []
+        with self._lock:
+            for size in request[Key.SIZES]:
+                group = self._stat.size_group.get(size, None)
+                if group:
+                    files.append([size, len(group)])
+
         Util.debug(
-            f"req-check hash: {request[Key.REQUEST_ID]}-{os.path.basename(request[Key.PATH])}[{len(request[Key.HASH]):02d}]",
+            f"req-check sizes: {request[Key.REQUEST_ID]}[{len(files)}/{len(request[Key.SIZES])}]",
             fmt_time=True,
         )
-        path = self._filter_by_hash(
+
+        return self._msg_builder.echo_sizes(
+            device_id=self._device_id,
             request_id=request[Key.REQUEST_ID],
+            files=files,
+        )
+
+    def _handle_req_heads(self, request: Dict) -> Dict:
+        request_id = request[Key.REQUEST_ID]
+        size = request[Key.SIZE]
+        heads = request[Key.HASH]
+        paths = request[Key.PATHS] or [None] * len(heads)
+
+        with self._lock:
+            group = list(self._stat.size_group.get(size, None) or [])
+
+        # 只有首块 hash 相同的候选文件需要比较
+        files = []
+        for i, (head, client_path) in enumerate(zip(heads, paths)):
+            if not group or not Util.is_serial_hashes([head], null_as_serial=False):
+                continue
+
+            candidates = self._index.lookup(size, head["hash"], group, self._head_hash)
+            path = self._filter_by_hash(
+                sorted(candidates),
+                request_id=f"{request_id}-{i}",
+                size=size,
+                local_mode=request[Key.LOCAL_MODE],
+                client_path=client_path,
+                client_hash=[head],
+            )
+            if path:
+                files.append([i, path])
+                self._speculate(path, 2, size)
+
+        Util.debug(
+            f"req-check heads: {request_id}[{len(files)}/{len(heads)}]",
+            fmt_time=True,
+        )
+
+        return self._msg_builder.echo_heads(
+            device_id=self._device_id, request_id=request_id, files=files
+        )
+
+    def _handle_req_chunk_hash(self, request: Dict) -> Dict:
+        request_id = request[Key.REQUEST_ID]
+        client_hash = request[Key.HASH]
+        session = self._sessions.get(request_id)
+
+        # delta 请求只包含新增的分段，与已匹配的部分拼接后比较；
+        # 会话已被淘汰时要求客户端重发完整列表
+        verified = None
+        if request.get(Key.DELTA, False):
+            matched = session.matched if session else None
+            if (
+                not matched
+                or not client_hash
+                or not isinstance(client_hash[0], dict)
+                or client_hash[0].get("serial", -1) != len(matched[1]) + 1
+            ):
+                Util.debug(
+                    f"req-check hash: {request_id}-{os.path.basename(request[Key.PATH])} resync",
+                    fmt_time=True,
+                )
+                return self._msg_builder.echo_hash(
+                    device_id=self._device_id,
+                    request_id=request_id,
+                    path=None,
+                    resync=True,
+                )
+
+            verified = matched
+            client_hash = matched[1] + client_hash
+
+        Util.debug(
+            f"req-check hash: {request_id}-{os.path.basename(request[Key.PATH])}[{len(client_hash):02d}]",
+            fmt_time=True,
+        )
+        size = request[Key.SIZE]
+        if not session:
+            with self._lock:
+                files = list(self._stat.size_group.get(size, None) or [])
+
+            if files and Util.is_serial_hashes(client_hash[:1], null_as_serial=False):
+                files = self._index.lookup(
+                    size, client_hash[0]["hash"], files, self._head_hash
+                )
+            session = Session(sorted(files) if files else None)
+
+        path = self._filter_by_hash(
+            session.files,
+            request_id=request_id,
+            size=size,
             local_mode=request[Key.LOCAL_MODE],
             client_path=request[Key.PATH],
-            size=request[Key.SIZE],
-            client_hash=request[Key.HASH],
+            client_hash=client_hash,
+            verified=verified,
         )
 
-        msg = self._msg_builder.echo_hash(
+        # 文件已确认唯一或全部分段已匹配，客户端不会再发送该 request_id
+        if not path or len(client_hash) >= self._ch.blocks(size):
+            self._sessions.pop(request_id)
+        else:
+            session.matched = (path, client_hash)
+            self._sessions.put(request_id, session)
+            self._speculate(path, len(client_hash) + 1, size)
+
+        return self._msg_builder.echo_hash(
             device_id=self._device_id,
-            request_id=request[Key.REQUEST_ID],
+            request_id=request_id,
             path=path,
         )
-        self._messanger.send_json(msg)
 
-    def _handle_req_file_hash(self, request: Dict):
+    def _handle_req_file_hash(self, request: Dict) -> Dict:
         path = request[Key.PATH]
         size = request[Key.SIZE]
         request_id = request[Key.REQUEST_ID]
@@ -100,40 +490,51 @@ class Server(Sweeper):
             file_hash = self._ch.file_hash(path)
             Util.debug(f"{file_hash}-{os.path.basename(path)}", fmt_indent=24)
 
-        msg = self._msg_builder.echo_calc_file_hash(
+        return self._msg_builder.echo_calc_file_hash(
             device_id=self._device_id, request_id=request_id, hash=file_hash
         )
 
-        self._messanger.send_json(msg)
+    def _head_hash(self, path: str) -> Optional[str]:
+        fstat = Util.stat(path)
+        if not fstat:
+            return None
+
+        with self._file_lock(path):
+            _, chunk_hashes = self._file_details(
+                path=path, size=fstat.st_size, mtime=fstat.st_mtime, request_id="index"
+            )
+
+        return chunk_hashes[0]["hash"] if chunk_hashes else None
 
     def _filter_by_hash(
         self,
+        files: Optional[List[str]],
         *,
         request_id: str,
+        size: int,
         local_mode: bool,
         client_path: str,
-        size: int,
         client_hash: List,
+        verified: Tuple[str, List] = None,
     ) -> str:
         if self._debug_mode:
-            self._show_session_files(request_id, True)
-
-        if request_id not in self._session:
-            self._session[request_id] = None
-            if size in self._stat.size_group:
-                self._session[request_id] = sorted(self._stat.size_group[size])
+            self._show_session_files(files, request_id, True)
 
         found = None
-        while self._session[request_id]:
-            path = self._session[request_id][0]
+        while files:
+            path = files[0]
             if local_mode and path == client_path:
-                self._session[request_id].pop(0)
+                files.pop(0)
                 if self._debug_mode:
                     Util.debug(f"pop session file[local]: {path}", fmt_indent=13)
                 continue
 
-            if not self._check_hash(request_id, path, client_path, client_hash):
-                file_poped = self._session[request_id].pop(0)
+            # 上一轮匹配的文件仍在队首时，只需比较新增的分段
+            skip = len(verified[1]) if verified and verified[0] == path else 0
+            if not self._check_hash(
+                request_id, path, client_path, client_hash, size=size, verified=skip
+            ):
+                file_poped = files.pop(0)
                 if self._debug_mode:
                     Util.debug(f"pop session file[hash]: {file_poped}", fmt_indent=13)
             else:
@@ -141,14 +542,21 @@ class Server(Sweeper):
                 break
 
         if self._debug_mode:
-            self._show_session_files(request_id, False)
+            self._show_session_files(files, request_id, False)
 
         return found
 
     def _check_hash(
-        self, request_id, path: str, client_path: str, client_hash: List
+        self,
+        request_id,
+        path: str,
+        client_path: str,
+        client_hash: List,
+        *,
+        size: int,
+        verified: int = 0,
     ) -> bool:
-        if not Util.is_serial_hashes(client_hash):
+        if not Util.is_serial_hashes(client_hash[verified:], start=verified + 1):
             Util.debug(
                 f"bad client chunk hashes: {os.path.basename(path)} <-> {os.path.basename(client_path)}",
                 fmt_time=True,
@@ -157,26 +565,116 @@ class Server(Sweeper):
             self._show_chunk_hash(client_hash, fmt_indent=16)
             return False
 
+        # size group 可能早于文件的改写或追加，大小不同的候选文件不是重复文件
         fstat = Util.stat(path)
-        if not fstat:
+        if not fstat or fstat.st_size != size:
             return False
 
-        fid, server_hash = self._file_details(
-            path=path,
-            size=fstat.st_size,
-            mtime=fstat.st_mtime,
-            request_id=request_id,
-            ref_hashes=client_hash,
+        self._await_speculation(path)
+        with self._file_lock(path):
+            fid, server_hash = self._file_details(
+                path=path,
+                size=fstat.st_size,
+                mtime=fstat.st_mtime,
+                request_id=request_id,
+                ref_hashes=client_hash,
+                ref_verified=verified,
+            )
+
+        if server_hash:
+            self._index.update(size, path, server_hash[0]["hash"])
+
+        if not server_hash or len(server_hash) < len(client_hash):
+            return False
+
+        if verified >= len(client_hash):
+            return True
+
+        return self._equal_chunk_hashes(
+            server_hash[verified : len(client_hash)], client_hash[verified:]
         )
 
-        if server_hash and len(server_hash) > len(client_hash):
-            server_hash = server_hash[: len(client_hash)]
+    @contextlib.contextmanager
+    def _file_lock(self, path: str):
+        # 多个客户端同时比较同一个候选文件时，后来的请求等待之前的计算完成后直接读取 HashDB
+        with self._file_locks_guard:
+            entry = self._file_locks.setdefault(path, [threading.Lock(), 0])
+            entry[1] += 1
+
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._file_locks_guard:
+                entry[1] -= 1
+                if 0 == entry[1]:
+                    self._file_locks.pop(path)
+
+    def _speculate(self, path: str, serial: int, size: int):
+        # 客户端的下一个请求通常是同一个候选文件的下一个分段
+        if not self._speculator or serial > self._ch.blocks(size):
+            return
 
-        return server_hash and self._equal_chunk_hashes(server_hash, client_hash)
+        nbytes = min(BLOCK_SIZE, size - HEAD_SIZE - (serial - 2) * BLOCK_SIZE)
+        with self._speculate_lock:
+            # 正在处理该文件的请求会自己计算需要的分段
+            with self._file_locks_guard:
+                hashing = path in self._file_locks
+            if (
+                hashing
+                or path in self._speculations
+                or self._speculate_bytes + nbytes > self._speculate_budget
+            ):
+                return
+
+            self._speculate_bytes += nbytes
+            self._speculations[path] = self._speculator.submit(
+                self._speculate_block, path, serial, nbytes
+            )
 
-    def _show_session_files(self, request_id: str, flag_initial: bool):
+    def _speculate_block(self, path: str, serial: int, nbytes: int):
+        # 读取和写入 HashDB 期间持有文件锁，同时到达的请求等待计算完成
+        try:
+            with self._file_lock(path):
+                fstat = Util.stat(path)
+                if not fstat:
+                    return
+
+                fid, chunk_hashes = self._db.get_file_details(
+                    path=path, size=fstat.st_size, mtime=fstat.st_mtime
+                )
+                # 文件已变化或该分段已经计算过
+                if -1 == fid or not chunk_hashes or len(chunk_hashes) != serial - 1:
+                    return
+
+                hash, block_size = self._ch.block_hash(path=path, serial=serial)
+                self._stat.on_hash(block_size)
+                if hash and self._db.add_chunk_hashes(
+                    fid=fid, hashes=[(serial, block_size, hash)]
+                ):
+                    Util.debug(
+                        f"{os.path.basename(path)}-[{serial:02d}] speculated",
+                        fmt_indent=9,
+                    )
+        except Exception:
+            traceback.print_exc()
+        finally:
+            with self._speculate_lock:
+                self._speculate_bytes -= nbytes
+                self._speculations.pop(path, None)
+
+    def _await_speculation(self, path: str):
+        # 该文件的下一个分段正在后台计算时等待其完成，避免重复读取
+        with self._speculate_lock:
+            future = self._speculations.get(path)
+
+        if future:
+            future.result()
+
+    def _show_session_files(
+        self, session_files: Optional[List[str]], request_id: str, flag_initial: bool
+    ):
         head = f"{'>>>' if flag_initial else '<<<'} session files [{request_id}]:"
-        session_files = self._session.get(request_id, None)
         if not session_files:
             Util.debug(f"{head} None", fmt_time=True)
             return
@@ -185,6 +683,12 @@ class Server(Sweeper):
         for i, path in enumerate(session_files):
             Util.debug(f"{i:02d}: {path}", fmt_indent=13)
 
+    def _show_session_stat(self):
+        Util.debug(
+            f"sessions: {len(self._sessions)} ({Util.readable_size(self._sessions.nbytes)}), hits: {self._sessions.hits}, misses: {self._sessions.misses}, evictions: {self._sessions.evictions}",
+            fmt_time=True,
+        )
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -197,6 +701,20 @@ def parse_args():
         help="the yaml config of directory list from where to compare file & release space",
     )
 
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        default=False,
+        help="keep size groups up to date while running, pre-hash changed files",
+    )
+
+    parser.add_argument(
+        "--asyncio",
+        action="store_true",
+        default=False,
+        help="serve multiple clients concurrently, each connection with its own session",
+    )
+
     parser.add_argument(
         "--debug",
         action="store_true",
@@ -211,7 +729,12 @@ if "__main__" == __name__:
     try:
         server = None
         args = parse_args()
-        server = Server(args.yaml, debug_mode=args.debug)
+        server = Server(
+            args.yaml,
+            debug_mode=args.debug,
+            watch_mode=args.watch,
+            async_mode=args.asyncio,
+        )
         server.start()
     except KeyboardInterrupt:
         pass
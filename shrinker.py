@@ -1,12 +1,15 @@
 import argparse
+import json
 import os
 import platform
 import random
 import re
 import socket
 import stat
+import threading
 import traceback
-from typing import List, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
 from src import Command, Key, Messanger, Role, Storage, Util
 
@@ -22,6 +25,8 @@ class Shrink(Storage):
         fast_delete=False,
         step_mode=True,
         erase_blank=False,
+        verify_threads=4,
+        verify="hash",
     ):
         super().__init__(
             Role.SHRINKER, yaml_file, limit=(limit_delete, 0), debug_mode=debug_mode
@@ -31,11 +36,17 @@ class Shrink(Storage):
         self._fast_delete = fast_delete
         self._step_mode = step_mode
         self._erase_blank = erase_blank
+        self._verify_threads = verify_threads
+        self._hasher: ThreadPoolExecutor = None
+        # 本地模式下可以直接逐块比较文件内容，不需要计算 hash
+        self._verify_bytes = "bytes" == verify and self._local_mode
 
     def _parse_yaml(self, config):
         super()._parse_yaml(config)
 
         self._local_mode = config.get("local_mode", False)
+        # 进程内扫描的结果没有独立的服务器，原始文件的 hash 在本地计算
+        self._in_process = config.get("in_process", False)
         self._sweep_dirs = [
             dir
             for dir in self._sweep_dirs
@@ -56,17 +67,36 @@ class Shrink(Storage):
                 self._remove_blanks()
 
             # 处理 重复文件
-            if self._erase_mode:
-                _socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                _socket.connect((self._host, self._port))
-                self._messanger = Messanger(self._device_id, _socket, self._debug_mode)
-
-            for chunk_hash, scan_result in self._config["duplicate"].items():
-                if self._stat.reach_limit():
-                    Util.debug("shrink limit reached", fmt_time=True)
-                    break
-
-                self._remove_duplicates(chunk_hash, scan_result)
+            if self._erase_mode and not self._in_process and not self._verify_bytes:
+                # 按重复记录中的服务器 id 连接对应的服务器，旧的记录只有一个服务器
+                self._messangers = {}
+                addresses = self._config.get("server_ids", None) or {
+                    None: f"{self._host}:{self._port}"
+                }
+                for server_id, address in addresses.items():
+                    messanger = self._connect(address)
+                    if not messanger:
+                        return
+                    self._messangers[server_id] = messanger
+                self._messanger = next(iter(self._messangers.values()))
+
+            # 删除前校验时，本地副本的 hash 在线程池中并行计算
+            if self._erase_mode and not self._fast_delete and not self._verify_bytes:
+                self._hasher = ThreadPoolExecutor(
+                    max_workers=max(self._verify_threads, 1),
+                    thread_name_prefix="verify",
+                )
+
+            try:
+                for chunk_hash, scan_result in self._duplicates():
+                    if self._stat.reach_limit():
+                        Util.debug("shrink limit reached", fmt_time=True)
+                        break
+
+                    self._remove_duplicates(chunk_hash, scan_result)
+            finally:
+                if self._hasher:
+                    self._hasher.shutdown(cancel_futures=True)
 
             result = "shrink completed"
             if self._stat.deleted > 0:
@@ -75,6 +105,18 @@ class Shrink(Storage):
         else:
             Util.debug("shrink aborted by user", fmt_time=True)
 
+    def _connect(self, address: str) -> Optional[Messanger]:
+        host, port = address.split(":")
+
+        _socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        _socket.connect((host, int(port)))
+        messanger = Messanger(self._device_id, _socket, self._debug_mode)
+        if not messanger.handshake(self._wire_formats, self._compressions):
+            Util.debug(f"handshake with server {address} failed", fmt_time=True)
+            return None
+
+        return messanger
+
     def _remove_blanks(self):
         for file in self._config["blank"]:
             if not Util.file_basic_check(file, 0):
@@ -104,7 +146,7 @@ class Shrink(Storage):
         mode = f"{'erase' if self._erase_mode else 'dry run'} mode"
         if self._erase_mode:
             mode += f": ** {'with' if self._step_mode else 'without'} ** confirmation before deletion"
-            mode += f"\n {' ' * 20}** {'without' if self._fast_delete else 'with'} ** file hash comparison before deletion"
+            mode += f"\n {' ' * 20}** {'without' if self._fast_delete else 'with'} ** file {'byte' if self._verify_bytes else 'hash'} comparison before deletion"
             mode += f"\n {' ' * 20}** {'delete' if self._erase_blank else 'keep'} ** blank files"
         Util.debug(mode, fmt_indent=9)
 
@@ -149,6 +191,33 @@ class Shrink(Storage):
             traceback.print_exc()
             return False
 
+    def _duplicates(self) -> Iterator[Tuple[str, List]]:
+        # yaml 中的重复文件列表，或者逐行读取扫描时写入的 JSONL 报告
+        report = self._config.get("duplicate_report", None)
+        if not report:
+            yield from self._config["duplicate"].items()
+            return
+
+        # 同一个 size group 的记录是连续的，每次只保存一个 size group 的重复文件
+        size, duplicates = None, {}
+        with open(report, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+
+                record = json.loads(line)
+                if size != record["size"]:
+                    yield from duplicates.items()
+                    size, duplicates = record["size"], {}
+
+                scan_result = duplicates.setdefault(
+                    record["key"],
+                    [f"{Util.readable_size(size)}-{size}", record["original"]],
+                )
+                scan_result.append(record["copy"])
+
+        yield from duplicates.items()
+
     def _parse_original(self, original: str) -> Tuple[str, str]:
         match = re.search(r"^original@(.+?):(.*)", original)
 
@@ -192,21 +261,39 @@ class Shrink(Storage):
                     file_original = random.choices(files_copy)
                 file_original = file_original[0]
 
-            server_hash = self._original_file_hash(
-                request_id=chunk_hash,
-                server_id=server_id,
-                path=file_original,
-                size=size,
-            )
-            if not server_hash:
-                return 0
+            if self._verify_bytes:
+                files_matched = set(
+                    self._ch.same_files(
+                        file_original,
+                        [path for path in files_copy if path != file_original],
+                    )
+                )
+            else:
+                # 本地副本的 hash 与服务器的请求同时计算
+                cancel = threading.Event()
+                futures = {
+                    self._hasher.submit(self._ch.file_hash, path, cancel=cancel): path
+                    for path in files_copy
+                    if not (self._local_mode and path == file_original)
+                }
+
+                server_hash = self._original_file_hash(
+                    request_id=chunk_hash,
+                    server_id=server_id,
+                    path=file_original,
+                    size=size,
+                )
+                files_matched = self._verify_copies(
+                    futures, server_hash, files_deletable, cancel
+                )
+                if files_matched is None:
+                    return 0
 
             # 第三遍筛选 文件 hash
             files_copy = [
                 path
                 for path in files_copy
-                if (self._local_mode and path == file_original)
-                or self._ch.file_hash(path) == server_hash
+                if (self._local_mode and path == file_original) or path in files_matched
             ]
             if not files_copy:
                 return 0
@@ -235,9 +322,42 @@ class Shrink(Storage):
 
         return deleted
 
+    def _verify_copies(
+        self,
+        futures: Dict[Future, str],
+        server_hash: Optional[str],
+        files_deletable: List,
+        cancel: threading.Event,
+    ) -> Optional[Set[str]]:
+        # 返回 hash 与原始文件相同的副本；可删除的副本都不相同时不再等待其余副本，返回 None
+        try:
+            if not server_hash:
+                return None
+
+            files_matched = set()
+            deletable = {path for path in files_deletable if path in futures.values()}
+            for future in as_completed(futures):
+                path = futures[future]
+                if future.result() == server_hash:
+                    files_matched.add(path)
+                    continue
+
+                deletable.discard(path)
+                if not deletable:
+                    return None
+
+            return files_matched
+        finally:
+            cancel.set()
+            for future in futures:
+                future.cancel()
+
     def _original_file_hash(
         self, *, request_id: str, server_id: str, path: str, size: int
     ) -> Optional[str]:
+        if self._in_process:
+            return self._ch.file_hash(path)
+
         msg = self._msg_builder.req_calc_file_hash(
             device_id=self._device_id,
             request_id=request_id,
@@ -245,10 +365,11 @@ class Shrink(Storage):
             path=path,
             size=size,
         )
-        if not self._messanger.send_json(msg):
+        messanger = self._messangers.get(server_id, self._messanger)
+        if not messanger.send_json(msg):
             return None
 
-        echo_message = self._messanger.recv_json()
+        echo_message = messanger.recv_json()
         if (
             echo_message
             and Command.ECHO_CALC_FILE_HASH == echo_message.get(Key.COMMAND, None)
@@ -273,7 +394,7 @@ class Shrink(Storage):
 
     def parse_duplicate_directory(self):
         dir_stat = {}
-        for _, scan_result in self._config["duplicate"].items():
+        for _, scan_result in self._duplicates():
             if self._local_mode:
                 _, file_original = self._parse_original(scan_result[1])
                 dir = os.path.dirname(file_original)
@@ -330,6 +451,20 @@ def parse_args():
         help="without file hash comparison against server before actually delete the files",
     )
 
+    parser.add_argument(
+        "--verify_threads",
+        type=check_max,
+        default=4,
+        help="number of threads computing local file hash before deletion",
+    )
+
+    parser.add_argument(
+        "--verify",
+        choices=["hash", "bytes"],
+        default="hash",
+        help="how to compare files before deletion, bytes: compare contents directly, local mode only",
+    )
+
     parser.add_argument(
         "--blank",
         action="store_true",
@@ -372,6 +507,8 @@ if "__main__" == __name__:
             fast_delete=args.fast_delete,
             step_mode=not args.auto,
             erase_blank=args.blank,
+            verify_threads=args.verify_threads,
+            verify=args.verify,
         )
         if args.parse:
             shrinker.parse_duplicate_directory()
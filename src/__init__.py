@@ -1,6 +1,23 @@
 from .command import Command, Key
 from .util import Util
+from .codec import CODECS, COMPRESSORS, BinaryCodec, JsonCodec
 from .chunk_hash import BLOCK_SIZE, HEAD_SIZE, READ_SIZE, ChunkHash
 from .hash_db import HashDB
 from .shrink_stat import ShrinkStat
-from .sweeper import Role, MessageBuilder, Messanger, Storage, Sweeper
+from .dir_watch import DirWatcher
+from .prehash import PreHasher
+from .session_cache import SessionCache
+from .head_index import HeadIndex
+from .partition import Partitioner
+from .schedule import SCHEDULERS, GroupEstimate, ReclaimScheduler, SizeScheduler
+from .sweeper import (
+    FEATURES,
+    AsyncMessanger,
+    LoopbackMessanger,
+    Role,
+    MessageBuilder,
+    Messanger,
+    Pipeline,
+    Storage,
+    Sweeper,
+)
@@ -1,6 +1,8 @@
+import contextlib
 import hashlib
+import threading
 import traceback
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
 HEAD_SIZE = 128 * 1024
 BLOCK_SIZE = 64 * 1024 * 1024
@@ -67,15 +69,46 @@ class ChunkHash:
             traceback.print_exc()
             return None, 0
 
-    def file_hash(self, path, chunk_size=READ_SIZE) -> Optional[str]:
+    def file_hash(
+        self, path, chunk_size=READ_SIZE, *, cancel: threading.Event = None
+    ) -> Optional[str]:
+        # cancel 被设置后停止读取，返回 None
         try:
             md5 = hashlib.md5()
 
             with open(path, "rb") as f:
                 for chunk in iter(lambda: f.read(chunk_size), b""):
+                    if cancel and cancel.is_set():
+                        return None
                     md5.update(chunk)
 
             return md5.hexdigest()
         except Exception:
             traceback.print_exc()
             return None
+
+    def same_files(self, path, others: List, chunk_size=READ_SIZE) -> List:
+        # 同时打开所有文件逐块比较，返回与 path 内容相同的文件；所有文件都不同时提前结束
+        try:
+            with contextlib.ExitStack() as stack:
+                f = stack.enter_context(open(path, "rb"))
+                files = {}
+                for other in others:
+                    try:
+                        files[other] = stack.enter_context(open(other, "rb"))
+                    except Exception:
+                        traceback.print_exc()
+
+                while files:
+                    chunk = f.read(chunk_size)
+                    for other, fo in list(files.items()):
+                        if fo.read(chunk_size) != chunk:
+                            del files[other]
+
+                    if not chunk:
+                        break
+
+                return [other for other in others if other in files]
+        except Exception:
+            traceback.print_exc()
+            return []
@@ -0,0 +1,296 @@
+import json
+import struct
+import zlib
+from typing import Dict, List, Tuple
+
+from src import Command, Key
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 值类型标记
+T_NONE = 0
+T_FALSE = 1
+T_TRUE = 2
+T_INT = 3
+T_FLOAT = 4
+T_STR = 5
+T_DIGEST = 6
+T_COMMAND = 7
+T_LIST = 8
+T_DICT = 9
+T_CHUNKS = 10
+T_UINT64S = 11
+
+# 不在 Key 中的字段名
+KEY_OTHER = 0xFF
+
+KEYS: List[str] = [str(key) for key in Key]
+KEY_CODES: Dict[str, int] = {key: code for code, key in enumerate(KEYS)}
+COMMANDS: List[str] = [str(command) for command in Command]
+COMMAND_CODES: Dict[str, int] = {cmd: code for code, cmd in enumerate(COMMANDS)}
+
+HEX_CHARS = frozenset("0123456789abcdef")
+CHUNK_KEYS = ("serial", "block_size", "hash")
+FLOAT = struct.Struct("!d")
+UINT64_MAX = 2**64 - 1
+
+
+class JsonCodec:
+    name = "json"
+
+    def encode(self, message: Dict) -> bytes:
+        return json.dumps(message).encode()
+
+    def decode(self, data: bytes) -> Dict:
+        return json.loads(data.decode())
+
+
+class BinaryCodec:
+    # 字段名和命令用 1 字节编码，整数用 varint，hash 用原始字节
+    name = "binary"
+
+    def encode(self, message: Dict) -> bytes:
+        out = bytearray()
+        self._put_varint(out, len(message))
+        for key, value in message.items():
+            code = KEY_CODES.get(key, KEY_OTHER)
+            out.append(code)
+            if KEY_OTHER == code:
+                self._put_str(out, key)
+            self._put_value(out, value)
+
+        return bytes(out)
+
+    def decode(self, data: bytes) -> Dict:
+        view = memoryview(data)
+        fields, pos = self._get_varint(view, 0)
+
+        message = {}
+        for _ in range(fields):
+            code = view[pos]
+            pos += 1
+            if KEY_OTHER == code:
+                key, pos = self._get_str(view, pos)
+            else:
+                key = KEYS[code]
+            message[key], pos = self._get_value(view, pos)
+
+        if pos != len(view):
+            raise ValueError(f"{len(view) - pos} trailing bytes in binary message")
+
+        return message
+
+    def _put_value(self, out: bytearray, value):
+        if value is None:
+            out.append(T_NONE)
+        elif value is True:
+            out.append(T_TRUE)
+        elif value is False:
+            out.append(T_FALSE)
+        elif isinstance(value, int):
+            out.append(T_INT)
+            self._put_varint(out, (value << 1) if value >= 0 else ((-value << 1) - 1))
+        elif isinstance(value, float):
+            out.append(T_FLOAT)
+            out += FLOAT.pack(value)
+        elif isinstance(value, Command):
+            out.append(T_COMMAND)
+            out.append(COMMAND_CODES[str(value)])
+        elif isinstance(value, str):
+            if value and 0 == len(value) % 2 and HEX_CHARS.issuperset(value):
+                out.append(T_DIGEST)
+                self._put_varint(out, len(value) // 2)
+                out += bytes.fromhex(value)
+            else:
+                out.append(T_STR)
+                self._put_str(out, value)
+        elif isinstance(value, (list, tuple)):
+            # 大量整数（如文件大小列表）按定长打包，避免逐个 varint 编码
+            if len(value) > 16 and all(
+                type(item) is int and 0 <= item <= UINT64_MAX for item in value
+            ):
+                out.append(T_UINT64S)
+                self._put_varint(out, len(value))
+                out += struct.pack(f"!{len(value)}Q", *value)
+            elif value and all(self._is_chunk(item) for item in value):
+                out.append(T_CHUNKS)
+                self._put_varint(out, len(value))
+                for chunk in value:
+                    self._put_varint(out, chunk["serial"])
+                    self._put_varint(out, chunk["block_size"])
+                    self._put_value(out, chunk["hash"])
+            else:
+                out.append(T_LIST)
+                self._put_varint(out, len(value))
+                for item in value:
+                    self._put_value(out, item)
+        elif isinstance(value, dict):
+            out.append(T_DICT)
+            self._put_varint(out, len(value))
+            for key, item in value.items():
+                self._put_str(out, str(key))
+                self._put_value(out, item)
+        else:
+            raise TypeError(f"unsupported value type: {type(value)}")
+
+    def _get_value(self, view: memoryview, pos: int) -> Tuple:
+        tag = view[pos]
+        pos += 1
+
+        if T_NONE == tag:
+            return None, pos
+        if T_TRUE == tag:
+            return True, pos
+        if T_FALSE == tag:
+            return False, pos
+        if T_INT == tag:
+            value, pos = self._get_varint(view, pos)
+            return (value >> 1) if not value & 1 else -((value + 1) >> 1), pos
+        if T_FLOAT == tag:
+            return FLOAT.unpack_from(view, pos)[0], pos + FLOAT.size
+        if T_COMMAND == tag:
+            return COMMANDS[view[pos]], pos + 1
+        if T_STR == tag:
+            return self._get_str(view, pos)
+        if T_DIGEST == tag:
+            length, pos = self._get_varint(view, pos)
+            return view[pos : pos + length].hex(), pos + length
+        if T_LIST == tag:
+            items, pos = self._get_varint(view, pos)
+            value = []
+            for _ in range(items):
+                item, pos = self._get_value(view, pos)
+                value.append(item)
+            return value, pos
+        if T_UINT64S == tag:
+            items, pos = self._get_varint(view, pos)
+            end = pos + 8 * items
+            return list(struct.unpack(f"!{items}Q", view[pos:end])), end
+        if T_CHUNKS == tag:
+            items, pos = self._get_varint(view, pos)
+            value = []
+            for _ in range(items):
+                serial, pos = self._get_varint(view, pos)
+                block_size, pos = self._get_varint(view, pos)
+                hash, pos = self._get_value(view, pos)
+                value.append({"serial": serial, "block_size": block_size, "hash": hash})
+            return value, pos
+        if T_DICT == tag:
+            items, pos = self._get_varint(view, pos)
+            value = {}
+            for _ in range(items):
+                key, pos = self._get_str(view, pos)
+                value[key], pos = self._get_value(view, pos)
+            return value, pos
+
+        raise ValueError(f"unknown value tag: {tag}")
+
+    def _is_chunk(self, item) -> bool:
+        return (
+            isinstance(item, dict)
+            and CHUNK_KEYS == tuple(item.keys())
+            and isinstance(item["serial"], int)
+            and item["serial"] >= 0
+            and isinstance(item["block_size"], int)
+            and item["block_size"] >= 0
+        )
+
+    def _put_varint(self, out: bytearray, value: int):
+        while value > 0x7F:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+
+    def _get_varint(self, view: memoryview, pos: int) -> Tuple[int, int]:
+        value = shift = 0
+        while True:
+            byte = view[pos]
+            pos += 1
+            value |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return value, pos
+            shift += 7
+
+    def _put_str(self, out: bytearray, value: str):
+        raw = value.encode("utf-8", "surrogateescape")
+        self._put_varint(out, len(raw))
+        out += raw
+
+    def _get_str(self, view: memoryview, pos: int) -> Tuple[str, int]:
+        length, pos = self._get_varint(view, pos)
+        return str(view[pos : pos + length], "utf-8", "surrogateescape"), pos + length
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec(), BinaryCodec())}
+
+
+class ZlibCompressor:
+    name = "zlib"
+    flag = 1
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, 3)
+
+    def decompress(self, data: bytes, max_size: int) -> bytes:
+        decompressor = zlib.decompressobj()
+        raw = decompressor.decompress(data, max_size)
+        if decompressor.unconsumed_tail:
+            raise ValueError(f"decompressed frame exceeds {max_size} bytes")
+
+        return raw
+
+
+class Lz4Compressor:
+    name = "lz4"
+    flag = 2
+
+    def compress(self, data: bytes) -> bytes:
+        return lz4.frame.compress(data)
+
+    def decompress(self, data: bytes, max_size: int) -> bytes:
+        # 最多解压 max_size + 1 字节，超出限制时不会完整解压
+        decompressor = lz4.frame.LZ4FrameDecompressor()
+        raw = decompressor.decompress(data, max_length=max_size + 1)
+        if len(raw) > max_size:
+            raise ValueError(f"decompressed frame exceeds {max_size} bytes")
+
+        return raw
+
+
+class ZstdCompressor:
+    name = "zstd"
+    flag = 3
+
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=3)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def decompress(self, data: bytes, max_size: int) -> bytes:
+        # 帧头中有原始大小时 max_output_size 不起作用，先检查帧头
+        if zstandard.frame_content_size(data) > max_size:
+            raise ValueError(f"decompressed frame exceeds {max_size} bytes")
+
+        return self._decompressor.decompress(data, max_output_size=max_size)
+
+
+# 按优先级排列，只包含当前环境可用的压缩算法
+COMPRESSORS = {
+    compressor.name: compressor
+    for compressor in (
+        ZstdCompressor() if zstandard else None,
+        Lz4Compressor() if lz4 else None,
+        ZlibCompressor(),
+    )
+    if compressor
+}
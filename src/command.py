@@ -9,9 +9,18 @@ except ImportError:
 
 
 class Command(StrEnum):
+    HELLO = "hello"
+    ECHO_HELLO = "echo_hello"
+
     CHECK_SIZE = "check_size"
     ECHO_CHECK_SIZE = "echo_check_size"
 
+    CHECK_SIZES = "check_sizes"
+    ECHO_CHECK_SIZES = "echo_check_sizes"
+
+    CHECK_HEADS = "check_heads"
+    ECHO_CHECK_HEADS = "echo_check_heads"
+
     CHECK_HASH = "check_hash"
     ECHO_CHECK_HASH = "echo_check_hash"
 
@@ -27,5 +36,12 @@ class Key(StrEnum):
     LOCAL_MODE = "local_mode"
     PATH = "path"
     SIZE = "size"
+    SIZES = "sizes"
+    PATHS = "paths"
     HASH = "hashes"
     RESULT = "result"
+    WIRE_FORMAT = "wire_format"
+    COMPRESSION = "compression"
+    FEATURES = "features"
+    DELTA = "delta"
+    RESYNC = "resync"
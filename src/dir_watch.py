@@ -0,0 +1,249 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import traceback
+from typing import Callable, Dict, List, Tuple
+
+from src import Util
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_ONLYDIR
+)
+
+EVENT_HEAD = struct.Struct("iIII")
+# 等待事件的超时秒数，超时后检查是否已经停止
+READ_TIMEOUT = 1
+
+
+class DirWatcher(threading.Thread):
+    # on_change(path): path 为可能发生变化的文件或目录，由调用方重新 stat 判断
+    def __init__(self, dirs: List[str], on_change: Callable[[str], None]):
+        super().__init__(daemon=True)
+
+        self._dirs = dirs
+        self._on_change = on_change
+        self._stop_event = threading.Event()
+
+    @staticmethod
+    def create(
+        dirs: List[str], on_change: Callable[[str], None], *, interval: float = 60
+    ) -> "DirWatcher":
+        try:
+            return InotifyWatcher(dirs, on_change)
+        except OSError as exp:
+            Util.debug(
+                f"inotify unavailable ({exp}), polling every {interval} seconds",
+                fmt_time=True,
+            )
+            return PollWatcher(dirs, on_change, interval=interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _notify(self, path: str):
+        try:
+            self._on_change(path)
+        except Exception:
+            traceback.print_exc()
+
+
+class InotifyWatcher(DirWatcher):
+    def __init__(self, dirs: List[str], on_change: Callable[[str], None]):
+        super().__init__(dirs, on_change)
+
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name:
+            raise OSError("libc not found")
+
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify not supported")
+
+        self._fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        # key: watch descriptor, value: directory
+        self._wds: Dict[int, str] = {}
+        try:
+            for top in dirs:
+                self._watch_tree(top)
+        except OSError:
+            os.close(self._fd)
+            raise
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set():
+                readable, _, _ = select.select([self._fd], [], [], READ_TIMEOUT)
+                if readable:
+                    self._dispatch(os.read(self._fd, 64 * 1024))
+        except Exception:
+            traceback.print_exc()
+        finally:
+            os.close(self._fd)
+
+    def _dispatch(self, buffer: bytes):
+        offset = 0
+        while offset + EVENT_HEAD.size <= len(buffer):
+            wd, mask, _, length = EVENT_HEAD.unpack_from(buffer, offset)
+            name = buffer[offset + EVENT_HEAD.size : offset + EVENT_HEAD.size + length]
+            offset += EVENT_HEAD.size + length
+
+            # 事件队列溢出，全部目录重新同步
+            if mask & IN_Q_OVERFLOW:
+                Util.debug("inotify queue overflow, resync all", fmt_time=True)
+                for top in self._dirs:
+                    self._notify(top)
+                continue
+
+            if mask & IN_IGNORED:
+                self._wds.pop(wd, None)
+                continue
+
+            root = self._wds.get(wd)
+            if root is None:
+                continue
+
+            name = name.rstrip(b"\0")
+            path = os.path.join(root, os.fsdecode(name)) if name else root
+
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self._watch_tree(path)
+                except OSError:
+                    traceback.print_exc()
+
+            self._notify(path)
+
+    def _watch_tree(self, top: str):
+        for root, _, _ in os.walk(top):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(root), WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, f"inotify_add_watch {root}: {os.strerror(errno)}")
+
+            self._wds[wd] = root
+
+
+class PollWatcher(DirWatcher):
+    # 只比较目录 mtime，目录内文件增删改名都会改变目录 mtime；
+    # 不改变目录 mtime 的原地改写要等到下次完整遍历才能发现
+    def __init__(
+        self, dirs: List[str], on_change: Callable[[str], None], *, interval: float
+    ):
+        super().__init__(dirs, on_change)
+
+        self._interval = interval
+        # key: directory, value: (mtime_ns, {name: (is_dir, size, mtime_ns)})
+        self._snapshot: Dict[str, Tuple[int, Dict[str, Tuple]]] = {}
+
+    def run(self):
+        for top in self._dirs:
+            self._poll(top, notify=False)
+
+        while not self._stop_event.wait(self._interval):
+            for top in self._dirs:
+                self._poll(top, notify=True)
+
+    def _poll(self, top: str, *, notify: bool):
+        dirs = [top]
+        while dirs:
+            root = dirs.pop()
+
+            dstat = Util.stat(root, follow_symlinks=True)
+            if not dstat:
+                self._forget(root)
+                continue
+
+            known = self._snapshot.get(root)
+            if known and known[0] == dstat.st_mtime_ns:
+                entries = known[1]
+            else:
+                entries = self._list_dir(root)
+                if entries is None:
+                    continue
+
+                self._snapshot[root] = (dstat.st_mtime_ns, entries)
+                if notify:
+                    self._diff(root, known[1] if known else {}, entries)
+
+            dirs.extend(
+                os.path.join(root, name)
+                for name, (is_dir, _, _) in entries.items()
+                if is_dir
+            )
+
+    def _diff(self, root: str, old: Dict[str, Tuple], new: Dict[str, Tuple]):
+        for name in old.keys() - new.keys():
+            path = os.path.join(root, name)
+            if old[name][0]:
+                self._forget(path)
+            self._notify(path)
+
+        for name, entry in new.items():
+            if old.get(name) == entry:
+                continue
+
+            path = os.path.join(root, name)
+            if entry[0]:
+                # 新目录由 _poll 继续遍历，其中的文件逐个通知
+                if name not in old or not old[name][0]:
+                    self._snapshot[path] = (-1, {})
+                    if name in old:
+                        self._notify(path)
+                continue
+
+            if name in old and old[name][0]:
+                self._forget(path)
+            self._notify(path)
+
+    def _forget(self, top: str):
+        prefix = os.path.join(top, "")
+        for dir in [d for d in self._snapshot if d == top or d.startswith(prefix)]:
+            self._snapshot.pop(dir, None)
+
+    def _list_dir(self, root: str):
+        entries = {}
+        try:
+            with os.scandir(root) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        entries[entry.name] = (True, 0, 0)
+                        continue
+
+                    fstat = Util.stat(entry.path)
+                    if fstat:
+                        entries[entry.name] = (
+                            False,
+                            fstat.st_size,
+                            fstat.st_mtime_ns,
+                        )
+        except OSError:
+            return None
+
+        return entries
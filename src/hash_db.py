@@ -1,18 +1,45 @@
+import functools
 import os
 import sqlite3
+import threading
 import traceback
 from typing import Dict, List, Optional, Tuple
 
 from src import Util
 
+# 等待其他连接释放写锁的秒数
+DB_TIMEOUT = 30
+
+
+def _synchronized(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
 
 class HashDB:
-    def __init__(self, db_path: str):
-        self.conn = sqlite3.connect(db_path)
+    # shared: 连接可以被多个线程使用（如服务器的 executor），所有操作串行执行
+    def __init__(self, db_path: str, *, shared: bool = False):
+        self._lock = threading.RLock()
+        # 多进程扫描时 worker 各自打开同一个数据库，WAL 模式下读写互不阻塞，写入时等待锁
+        self.conn = sqlite3.connect(
+            db_path, check_same_thread=not shared, timeout=DB_TIMEOUT
+        )
         self.conn.row_factory = sqlite3.Row
         self.conn.execute("PRAGMA foreign_keys = ON;")
+        if ":memory:" != db_path:
+            self.conn.execute("PRAGMA journal_mode = WAL;")
         self.create_tables()
 
+    @property
+    def lock(self) -> threading.RLock:
+        # 多个操作需要作为整体执行时由调用方持有，可以嵌套
+        return self._lock
+
+    @_synchronized
     def create_tables(self):
         cursor = self.conn.cursor()
 
@@ -40,9 +67,33 @@ class HashDB:
             )
         """)
 
+        # 目录快照表，mtime 未变化的目录无需重新遍历
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS directory (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                path TEXT NOT NULL UNIQUE,
+                mtime INTEGER NOT NULL,
+                entries INTEGER NOT NULL
+            )
+        """)
+
+        # 目录项表
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS directory_entry (
+                did INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                is_dir INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mode INTEGER NOT NULL,
+                PRIMARY KEY (did, name),
+                FOREIGN KEY (did) REFERENCES directory(id) ON DELETE CASCADE
+            )
+        """)
+
         self.conn.commit()
 
     # 插入文件信息，返回 fid
+    @_synchronized
     def add_file(self, *, path: str, name: str, size: int, mtime: float) -> int:
         cursor = self.conn.cursor()
 
@@ -68,6 +119,7 @@ class HashDB:
             return -1
 
     # 插入分段 hash（可以批量）
+    @_synchronized
     def add_chunk_hashes(self, *, fid: int, hashes: List[Tuple[int, int, str]]) -> bool:
         cursor = self.conn.cursor()
 
@@ -93,6 +145,7 @@ class HashDB:
             return False
 
     # 按 path 查询文件信息
+    @_synchronized
     def get_file(self, path: str) -> Optional[Dict]:
         fp = os.path.abspath(path)
 
@@ -106,6 +159,7 @@ class HashDB:
         return dict(row) if row else None
 
     # 查询文件信息
+    @_synchronized
     def get_file_by_id(self, fid: int) -> Optional[Dict]:
         cursor = self.conn.cursor()
         cursor.execute("SELECT * FROM file WHERE id = ?", (fid,))
@@ -114,6 +168,7 @@ class HashDB:
         return dict(row) if row else None
 
     # 按 size 查询文件信息
+    @_synchronized
     def get_file_by_size(self, size: int) -> List[Dict]:
         cursor = self.conn.cursor()
         cursor.execute(
@@ -125,6 +180,19 @@ class HashDB:
             rows = [dict(row) for row in rows]
         return rows
 
+    # 按 size 统计已保存的分段 hash 字节数
+    @_synchronized
+    def get_hashed_bytes(self) -> Dict[int, int]:
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT file.size, SUM(chunk_hash.block_size) FROM file
+            JOIN chunk_hash ON chunk_hash.fid = file.id
+            GROUP BY file.size
+        """)
+
+        return {size: hashed for size, hashed in cursor.fetchall()}
+
+    @_synchronized
     def update_file(self, *, fid: int, size: int, mtime: float) -> bool:
         try:
             cursor = self.conn.cursor()
@@ -141,6 +209,7 @@ class HashDB:
 
             return False
 
+    @_synchronized
     def get_file_details(
         self, *, path: str, size: int, mtime: float
     ) -> Tuple[int, List]:
@@ -174,6 +243,7 @@ class HashDB:
         return fid, chunk_hashes
 
     # 查询分段 hash
+    @_synchronized
     def get_chunk_hashes(self, fid: int) -> List[Dict]:
         cursor = self.conn.cursor()
         cursor.execute(
@@ -186,6 +256,7 @@ class HashDB:
             rows = [dict(row) for row in rows]
         return rows
 
+    @_synchronized
     def delete_chunk_hashes(self, fid: int) -> bool:
         try:
             cursor = self.conn.cursor()
@@ -201,6 +272,7 @@ class HashDB:
             return False
 
     # 删除文件及其关联的 hash
+    @_synchronized
     def delete_file(self, fid: int) -> bool:
         try:
             cursor = self.conn.cursor()
@@ -215,5 +287,95 @@ class HashDB:
 
             return False
 
+    # 查询目录快照，返回 (mtime_ns, [(name, is_dir, size, mode)])
+    @_synchronized
+    def get_dir_snapshot(self, path: str) -> Optional[Tuple[int, List[Tuple]]]:
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT id, mtime, entries FROM directory WHERE path = ?",
+            (os.path.abspath(path),),
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+
+        cursor.execute(
+            "SELECT name, is_dir, size, mode FROM directory_entry WHERE did = ? ORDER BY name",
+            (row["id"],),
+        )
+        entries = [
+            (entry["name"], bool(entry["is_dir"]), entry["size"], entry["mode"])
+            for entry in cursor.fetchall()
+        ]
+
+        # 快照不完整时视为无效
+        if len(entries) != row["entries"]:
+            return None
+
+        return row["mtime"], entries
+
+    @_synchronized
+    def save_dir_snapshot(
+        self, *, path: str, mtime: int, entries: List[Tuple], commit: bool = True
+    ) -> bool:
+        cursor = self.conn.cursor()
+
+        try:
+            fp = os.path.abspath(path)
+            cursor.execute("DELETE FROM directory WHERE path = ?", (fp,))
+            cursor.execute(
+                "INSERT INTO directory (path, mtime, entries) VALUES (?, ?, ?)",
+                (fp, mtime, len(entries)),
+            )
+            did = cursor.lastrowid
+            cursor.executemany(
+                """
+                INSERT INTO directory_entry (did, name, is_dir, size, mode)
+                VALUES (?, ?, ?, ?, ?)
+            """,
+                [
+                    (did, name, int(is_dir), size, mode)
+                    for name, is_dir, size, mode in entries
+                ],
+            )
+            if commit:
+                self.conn.commit()
+
+            return True
+        except Exception:
+            Util.debug(f"save_dir_snapshot(path={path})", fmt_time=True)
+            traceback.print_exc()
+            self.conn.rollback()
+
+            return False
+
+    # 删除目录及其所有子目录的快照
+    @_synchronized
+    def delete_dir_snapshots(self, path: str, *, commit: bool = True) -> bool:
+        fp = os.path.abspath(path)
+        prefix = os.path.join(fp, "")
+
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                "DELETE FROM directory WHERE path = ? OR substr(path, 1, ?) = ?",
+                (fp, len(prefix), prefix),
+            )
+            if commit:
+                self.conn.commit()
+
+            return True
+        except Exception:
+            Util.debug(f"delete_dir_snapshots(path={path})", fmt_time=True)
+            traceback.print_exc()
+            self.conn.rollback()
+
+            return False
+
+    @_synchronized
+    def commit(self):
+        self.conn.commit()
+
+    @_synchronized
     def close(self):
         self.conn.close()
@@ -0,0 +1,82 @@
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+
+class HeadIndex:
+    # (size, 首块 hash) -> 文件列表，某个 size 第一次查询时建立
+    # head_of(path): 返回文件首块 hash，优先从 HashDB 读取，没有时计算
+    def __init__(self):
+        # key: size, value: {首块 hash: [path]}
+        self._groups: Dict[int, Dict[str, List[str]]] = {}
+        # key: path, value: (size, 首块 hash)
+        self._paths: Dict[str, Tuple[int, str]] = {}
+        # 已经建立索引的 size
+        self._complete: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def lookup(
+        self,
+        size: int,
+        head: str,
+        files: List[str],
+        head_of: Callable[[str], Optional[str]],
+    ) -> List[str]:
+        with self._lock:
+            complete = size in self._complete
+
+        if not complete:
+            self._build(size, files, head_of)
+
+        with self._lock:
+            return list(self._groups.get(size, {}).get(head, []))
+
+    def add(self, size: int, path: str, head: str):
+        with self._lock:
+            self._discard(path)
+            self._paths[path] = (size, head)
+            self._groups.setdefault(size, {}).setdefault(head, []).append(path)
+
+    def update(self, size: int, path: str, head: str):
+        # 已索引的文件被原地改写后首块变化，移动到新的首块下
+        with self._lock:
+            entry = self._paths.get(path, None)
+            if entry and entry != (size, head):
+                self._discard(path)
+                self._paths[path] = (size, head)
+                self._groups.setdefault(size, {}).setdefault(head, []).append(path)
+
+    def discard(self, path: str):
+        with self._lock:
+            self._discard(path)
+
+    def invalidate(self, size: int):
+        # size group 有新文件，下次查询时补充
+        with self._lock:
+            self._complete.discard(size)
+
+    def _build(
+        self, size: int, files: List[str], head_of: Callable[[str], Optional[str]]
+    ):
+        with self._lock:
+            missing = [path for path in files if path not in self._paths]
+
+        for path in missing:
+            head = head_of(path)
+            if head:
+                self.add(size, path, head)
+
+        with self._lock:
+            self._complete.add(size)
+
+    def _discard(self, path: str):
+        entry = self._paths.pop(path, None)
+        if not entry:
+            return
+
+        size, head = entry
+        group = self._groups[size]
+        group[head].remove(path)
+        if not group[head]:
+            group.pop(head)
+            if not group:
+                self._groups.pop(size)
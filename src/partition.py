@@ -0,0 +1,43 @@
+from typing import Callable, Dict, Iterator, List, Optional
+
+
+class Partitioner:
+    # 本地模式下把一个 size group 作为整体比较：每一轮计算所有剩余文件的同一个分段，
+    # 按 hash 分桶，只有一个文件的桶直接淘汰
+    # block_hash(path, serial): 返回分段 hash，读取失败时返回 None，该文件不再参与比较
+    def __init__(self, blocks: int, block_hash: Callable[[str, int], Optional[str]]):
+        self._blocks = blocks
+        self._block_hash = block_hash
+
+    @property
+    def stages(self) -> List[int]:
+        # 首块、尾块、中间的分段，每个文件的每个分段最多读取一次
+        if 1 == self._blocks:
+            return [1]
+
+        return [1, self._blocks, *range(2, self._blocks)]
+
+    def split(self, files: List[str]) -> Iterator[List[str]]:
+        # 逐个返回重复文件的分组，组内保持 files 中的顺序；
+        # 一个桶比较完所有分段后才处理下一个桶，调用方停止迭代后不再读取其余的桶
+        stages = self.stages
+        buckets = [(files, 0)] if len(files) > 1 else []
+
+        while buckets:
+            bucket, stage = buckets.pop()
+            if stage == len(stages):
+                yield bucket
+                continue
+
+            parts = self._partition(bucket, stages[stage])
+            buckets.extend((part, stage + 1) for part in reversed(parts))
+
+    def _partition(self, files: List[str], serial: int) -> List[List[str]]:
+        # key: 分段 hash, value: [path]
+        parts: Dict[str, List[str]] = {}
+        for path in files:
+            hash = self._block_hash(path, serial)
+            if hash:
+                parts.setdefault(hash, []).append(path)
+
+        return [part for part in parts.values() if len(part) > 1]
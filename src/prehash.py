@@ -0,0 +1,178 @@
+import contextlib
+import itertools
+import os
+import queue
+import threading
+import time
+import traceback
+from typing import Callable, ContextManager, Dict, List, Optional
+
+from src import ChunkHash, HashDB, Util
+
+# 文件变化优先于预热
+PRIORITY_CHANGE = 0
+PRIORITY_WARM_UP = 1
+
+
+class PreHasher(threading.Thread):
+    # 后台计算文件首块 hash 并写入 HashDB，sqlite 连接只能在创建它的线程中使用
+    # rate: 预热时每秒最多读取的字节数，0 表示不限制
+    # on_hashed(path, size, hash): 首块 hash 已经写入 HashDB
+    # file_lock(path): 与处理请求的线程共用的文件锁，同一个文件的记录不会被同时写入
+    def __init__(
+        self,
+        db_path: str,
+        *,
+        debug_mode: bool = False,
+        rate: int = 0,
+        on_hashed: Optional[Callable[[str, int, str], None]] = None,
+        file_lock: Optional[Callable[[str], ContextManager]] = None,
+    ):
+        super().__init__(daemon=True)
+
+        self._db_path = db_path
+        self._debug_mode = debug_mode
+        self._rate = rate
+        self._on_hashed = on_hashed
+        self._file_lock = file_lock
+        self._ch = ChunkHash()
+
+        # (priority, 序号, action, path)，同一优先级按提交顺序处理
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+
+        # 正在处理的客户端请求数，大于 0 时暂停
+        self._busy = 0
+        self._idle = threading.Condition()
+        self._warming = 0
+
+    def submit(self, path: str):
+        self._put(PRIORITY_CHANGE, "hash", path)
+
+    def discard(self, path: str):
+        self._put(PRIORITY_CHANGE, "drop", path)
+
+    def warm_up(self, size_group: Dict[int, List[str]]):
+        # 只预热有多个文件的 size group，文件多的优先
+        groups = sorted(
+            ((size, files) for size, files in size_group.items() if len(files) > 1),
+            key=lambda group: (len(group[1]), group[0]),
+            reverse=True,
+        )
+        for _, files in groups:
+            for path in files:
+                self._put(PRIORITY_WARM_UP, "warm", path)
+
+        Util.debug(
+            f"warm-up: {sum(len(files) for _, files in groups)} files in {len(groups)} size groups",
+            fmt_time=True,
+        )
+
+    @contextlib.contextmanager
+    def hold(self):
+        # 处理客户端请求期间暂停后台 hash
+        with self._idle:
+            self._busy += 1
+        try:
+            yield
+        finally:
+            with self._idle:
+                self._busy -= 1
+                if 0 == self._busy:
+                    self._idle.notify_all()
+
+    def _put(self, priority: int, action: str, path: str):
+        with self._pending_lock:
+            if (action, path) in self._pending:
+                return
+            self._pending.add((action, path))
+            if "warm" == action:
+                self._warming += 1
+
+        self._queue.put((priority, next(self._counter), action, path))
+
+    def run(self):
+        db = HashDB(self._db_path)
+        try:
+            while True:
+                _, _, action, path = self._queue.get()
+                with self._pending_lock:
+                    self._pending.discard((action, path))
+
+                with self._idle:
+                    self._idle.wait_for(lambda: 0 == self._busy)
+
+                try:
+                    hashed = 0
+                    with (
+                        self._file_lock(path)
+                        if self._file_lock
+                        else contextlib.nullcontext()
+                    ):
+                        if "drop" == action:
+                            self._drop(db, path)
+                        else:
+                            hashed = self._head_hash(db, path)
+                    if "warm" == action:
+                        self._throttle(hashed)
+                except Exception:
+                    traceback.print_exc()
+
+                if "warm" == action:
+                    with self._pending_lock:
+                        self._warming -= 1
+                        if 0 == self._warming:
+                            Util.debug("warm-up finished", fmt_time=True)
+        finally:
+            db.close()
+
+    def _throttle(self, hashed: int):
+        if self._rate > 0 and hashed > 0:
+            time.sleep(hashed / self._rate)
+
+    def _head_hash(self, db: HashDB, path: str) -> int:
+        # 返回读取的字节数，HashDB 中已有时为 0
+        fstat = Util.stat(path)
+        if not fstat or not Util.important_file(
+            fstat, os.path.dirname(path), os.path.basename(path)
+        ):
+            return 0
+
+        fid, chunk_hashes = db.get_file_details(
+            path=path, size=fstat.st_size, mtime=fstat.st_mtime
+        )
+        if chunk_hashes:
+            self._notify(path, fstat.st_size, chunk_hashes[0]["hash"])
+            return 0
+
+        if -1 == fid:
+            fid = db.add_file(
+                path=os.path.dirname(path),
+                name=os.path.basename(path),
+                size=fstat.st_size,
+                mtime=fstat.st_mtime,
+            )
+            if -1 == fid:
+                return 0
+
+        hash, block_size = self._ch.block_hash(path=path, serial=1)
+        if hash and db.add_chunk_hashes(fid=fid, hashes=[(1, block_size, hash)]):
+            self._notify(path, fstat.st_size, hash)
+            if self._debug_mode:
+                Util.debug(f"{os.path.basename(path)}-[01] pre-hashed", fmt_indent=9)
+
+        return block_size
+
+    def _notify(self, path: str, size: int, hash: str):
+        if self._on_hashed:
+            try:
+                self._on_hashed(path, size, hash)
+            except Exception:
+                traceback.print_exc()
+
+    def _drop(self, db: HashDB, path: str):
+        row = db.get_file(path)
+        if row:
+            db.delete_file(row["id"])
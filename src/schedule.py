@@ -0,0 +1,70 @@
+from typing import List, Optional
+
+from src import HEAD_SIZE
+
+# 两个相同大小的文件内容相同的先验概率
+DUPLICATE_PRIOR = 0.1
+
+
+class GroupEstimate:
+    # 一个 size group 的调度依据
+    def __init__(
+        self,
+        *,
+        size: int,
+        files: int,
+        server_files: Optional[int] = None,
+        cached: int = 0,
+    ):
+        self.size = size
+        self.files = files
+        # 服务器上相同大小的文件数，本地模式为 None
+        self.server_files = server_files
+        # HashDB 中已经保存的该大小文件的分段 hash 字节数
+        self.cached = cached
+
+
+class SizeScheduler:
+    # 大文件优先
+    name = "size"
+
+    def order(self, groups: List[GroupEstimate]) -> List[int]:
+        return sorted((group.size for group in groups), reverse=True)
+
+
+class ReclaimScheduler:
+    # 按预计释放的空间 / 预计需要计算 hash 的字节数排序，相同时大文件优先
+    name = "reclaim"
+
+    def score(self, group: GroupEstimate) -> float:
+        # 本地模式与同组的其他文件比较，保留一个副本
+        if group.server_files is None:
+            others, copies = group.files - 1, group.files - 1
+        else:
+            others, copies = group.server_files, group.files
+
+        # 至少与一个文件相同的概率
+        p = 1 - (1 - DUPLICATE_PRIOR) ** max(others, 0)
+        reclaim = p * copies * group.size
+
+        # 所有文件计算首块 hash，可能重复的文件计算其余分段，已缓存的部分不再计算
+        cost = (
+            group.files * min(group.size, HEAD_SIZE)
+            + p * group.files * max(group.size - HEAD_SIZE, 0)
+            - group.cached
+        )
+
+        return reclaim / max(cost, 1)
+
+    def order(self, groups: List[GroupEstimate]) -> List[int]:
+        return [
+            group.size
+            for group in sorted(
+                groups, key=lambda group: (self.score(group), group.size), reverse=True
+            )
+        ]
+
+
+SCHEDULERS = {
+    scheduler.name: scheduler for scheduler in (SizeScheduler(), ReclaimScheduler())
+}
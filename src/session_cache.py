@@ -0,0 +1,98 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+
+class SessionCache:
+    # 按 LRU 淘汰，超过 ttl 秒未访问的条目过期，条目总数及估算内存不超过上限
+    # sizeof(value): 估算条目占用的字节数，条目内容变化后需重新 put
+    def __init__(
+        self,
+        *,
+        max_entries: int = 100000,
+        max_bytes: int = 256 * 1024 * 1024,
+        ttl: float = 3600,
+        sizeof: Callable[[Any], int] = sys.getsizeof,
+    ):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._sizeof = sizeof
+
+        # key: request_id, value: (value, nbytes, last access)
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries[key] = (entry[0], entry[1], now)
+            self._entries.move_to_end(key)
+
+            return entry[0]
+
+    def put(self, key: str, value: Any):
+        nbytes = self._sizeof(value)
+
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+
+            entry = self._entries.pop(key, None)
+            if entry:
+                self._bytes -= entry[1]
+
+            self._entries[key] = (value, nbytes, now)
+            self._bytes += nbytes
+
+            # 至少保留刚放入的条目
+            while len(self._entries) > 1 and (
+                len(self._entries) > self._max_entries or self._bytes > self._max_bytes
+            ):
+                self._evict()
+
+    def pop(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+
+            self._bytes -= entry[1]
+            return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _expire(self, now: float):
+        while self._entries:
+            _, (_, _, accessed) = next(iter(self._entries.items()))
+            if now - accessed < self._ttl:
+                break
+            self._evict()
+
+    def _evict(self):
+        _, (_, nbytes, _) = self._entries.popitem(last=False)
+        self._bytes -= nbytes
+        self.evictions += 1
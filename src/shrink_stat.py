@@ -1,9 +1,14 @@
 import hashlib
+import json
 import os
-import re
-from typing import Dict, List
+import stat
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
 
-from src import Util
+from src import HashDB, Util
+
+SNAPSHOT_SETTLE_SECONDS = 2
 
 
 class ShrinkStat:
@@ -11,7 +16,10 @@ class ShrinkStat:
         self._files_0bytes = []
         self._files_errors = []
         self._files_duplicate = {}
+        self._files_original = set()
         self._files_ext = []
+        # 重复文件逐条追加到 JSONL 报告，本地模式以外不在内存中保存副本列表
+        self._report = None
 
         self._limit_delete, self._limit_scan = limit_delete, limit_scan
 
@@ -22,32 +30,216 @@ class ShrinkStat:
             self._hash_bytes,
             self._important_files,
         ) = [0] * 5
+        # 服务器的 executor 和后台预计算线程同时累计 hash 字节数
+        self._hash_lock = threading.Lock()
+
+        # 最近一个 size group 边界的状态，中断时 journal 只保存到该边界
+        self._mark: Optional[Dict] = None
+        # key: 边界之后修改过的重复组, value: 边界时的长度，新增的组为 0
+        self._mark_duplicates: Dict[str, int] = {}
+        # 边界之后新增的原始文件
+        self._mark_originals = set()
 
-    def group_by_size(self, dirs: List):
+    def group_by_size(self, dirs: List, *, db: HashDB = None):
         # key:      file size (int)
         # value:    file path list
         size_group: Dict[int, List[str]] = {}
 
         self._important_files = 0
         for top in dirs:
-            for root, _, files in os.walk(top):
-                for file in files:
+            for root, files in self._walk(top, db):
+                for file, size, mode in files:
                     path = os.path.join(root, file)
 
-                    fstat = Util.stat(path)
-                    if not fstat:
-                        continue
-
+                    fstat = os.stat_result((mode, 0, 0, 0, 0, 0, size, 0, 0, 0))
                     if Util.important_file(fstat, root, file):
-                        if fstat.st_size not in size_group:
-                            size_group[fstat.st_size] = []
-                        size_group[fstat.st_size].append(path)
+                        if size not in size_group:
+                            size_group[size] = []
+                        size_group[size].append(path)
                         self._important_files += 1
-                    elif 0 == fstat.st_size:
+                    elif 0 == size:
                         self.update_0bytes(path)
 
+        if db:
+            db.commit()
+
         self._size_group = size_group
 
+    def _walk(self, top: str, db: HashDB):
+        # 与 os.walk 相同的先序遍历，mtime 未变化的目录直接复用 HashDB 中的快照
+        dirs = [top]
+        while dirs:
+            root = dirs.pop()
+
+            dstat = Util.stat(root, follow_symlinks=True)
+            if not dstat:
+                continue
+
+            entries = None
+            snapshot = db.get_dir_snapshot(root) if db else None
+            if snapshot and snapshot[0] == dstat.st_mtime_ns:
+                entries = snapshot[1]
+            else:
+                entries = self._list_dir(root)
+                if entries is None:
+                    continue
+
+                if db:
+                    self._save_snapshot(db, root, dstat, entries, snapshot)
+
+            files, sub_dirs = [], []
+            for name, is_dir, size, mode in entries:
+                if is_dir:
+                    sub_dirs.append(os.path.join(root, name))
+                else:
+                    files.append((name, size, mode))
+
+            yield root, files
+
+            dirs.extend(reversed(sub_dirs))
+
+    def _list_dir(self, root: str) -> Optional[List[Tuple]]:
+        entries = []
+        try:
+            with os.scandir(root) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        entries.append((entry.name, True, 0, 0))
+                        continue
+
+                    fstat = Util.stat(entry.path)
+                    if fstat:
+                        entries.append(
+                            (entry.name, False, fstat.st_size, fstat.st_mode)
+                        )
+        except OSError:
+            return None
+
+        return entries
+
+    def _save_snapshot(
+        self,
+        db: HashDB,
+        root: str,
+        dstat: os.stat_result,
+        entries: List[Tuple],
+        snapshot: Optional[Tuple],
+    ):
+        # 已删除子目录的快照一并清理
+        if snapshot:
+            sub_dirs = {name for name, is_dir, _, _ in entries if is_dir}
+            for name, is_dir, _, _ in snapshot[1]:
+                if is_dir and name not in sub_dirs:
+                    db.delete_dir_snapshots(os.path.join(root, name), commit=False)
+
+        # mtime 精度较粗的文件系统上，刚修改过的目录可能再次变化而 mtime 不变
+        if time.time() - dstat.st_mtime < SNAPSHOT_SETTLE_SECONDS:
+            return
+
+        db.save_dir_snapshot(
+            path=root, mtime=dstat.st_mtime_ns, entries=entries, commit=False
+        )
+
+    def track(self):
+        # key: directory, value: {file name: (size, mtime_ns)}，用于文件变化后就地更新 size_group；
+        # 遍历时没有读取 mtime，为 None
+        self._tracked: Dict[str, Dict[str, Tuple[int, Optional[int]]]] = {}
+        for size, files in self._size_group.items():
+            for path in files:
+                root, name = os.path.split(path)
+                self._tracked.setdefault(root, {})[name] = (size, None)
+
+    def refresh(self, path: str) -> Tuple[List[str], List[str]]:
+        # return value (updated files, removed files)
+        updated, removed = [], []
+
+        fstat = Util.stat(path)
+        if not fstat or not stat.S_ISDIR(fstat.st_mode):
+            root, name = os.path.split(path)
+            if fstat and Util.important_file(fstat, root, name):
+                if self._track_file(path, fstat.st_size, fstat.st_mtime_ns):
+                    updated.append(path)
+            elif self._untrack_file(path):
+                removed.append(path)
+            elif not fstat or path in self._tracked:
+                # 被删除或被替换为文件的目录
+                removed.extend(self._untrack_tree(path))
+
+            return updated, removed
+
+        # 目录: 重新遍历后与已记录的文件比较
+        if self._untrack_file(path):
+            removed.append(path)
+
+        current = set()
+        for root, files in self._walk(path, None):
+            for file, size, mode in files:
+                fstat = os.stat_result((mode, 0, 0, 0, 0, 0, size, 0, 0, 0))
+                if Util.important_file(fstat, root, file):
+                    file_path = os.path.join(root, file)
+                    current.add(file_path)
+                    if self._track_file(file_path, size):
+                        updated.append(file_path)
+
+        for file_path in self._tracked_files(path):
+            if file_path not in current and self._untrack_file(file_path):
+                removed.append(file_path)
+
+        return updated, removed
+
+    def _track_file(self, path: str, size: int, mtime: Optional[int] = None) -> bool:
+        root, name = os.path.split(path)
+        files = self._tracked.setdefault(root, {})
+        known = files.get(name)
+        if known and known[0] == size:
+            # 大小不变的改写只更新 mtime，size_group 不变；未知的 mtime 视为已变化
+            if mtime is None or known[1] == mtime:
+                return False
+
+            files[name] = (size, mtime)
+            return True
+
+        if name in files:
+            self._untrack_file(path)
+            files = self._tracked.setdefault(root, {})
+
+        files[name] = (size, mtime)
+        self._size_group.setdefault(size, []).append(path)
+        self._important_files += 1
+
+        return True
+
+    def _untrack_file(self, path: str) -> bool:
+        root, name = os.path.split(path)
+        files = self._tracked.get(root)
+        if not files or name not in files:
+            return False
+
+        size, _ = files.pop(name)
+        if not files:
+            self._tracked.pop(root)
+
+        group = self._size_group.get(size)
+        if group and path in group:
+            group.remove(path)
+            if not group:
+                self._size_group.pop(size)
+        self._important_files -= 1
+
+        return True
+
+    def _tracked_files(self, top: str) -> List[str]:
+        prefix = os.path.join(top, "")
+        return [
+            os.path.join(root, name)
+            for root, files in self._tracked.items()
+            if root == top or root.startswith(prefix)
+            for name in files
+        ]
+
+    def _untrack_tree(self, top: str) -> List[str]:
+        return [path for path in self._tracked_files(top) if self._untrack_file(path)]
+
     def update_0bytes(self, path: str):
         self._files_0bytes.append(path)
 
@@ -84,16 +276,24 @@ class ShrinkStat:
 
         key = "-".join([hash["hash"] for hash in chunk_hashes])
         key = hashlib.md5(key.encode("utf-8")).hexdigest()
+        if self._mark:
+            self._mark_duplicates.setdefault(
+                key, len(self._files_duplicate.get(key, []))
+            )
         if key not in self._files_duplicate:
             duplicates = []
             duplicates.append(f"{Util.readable_size(free_space)}-{free_space}")
             duplicates.append(f"original@{server_id}:{server_path}")
             self._files_duplicate[key] = duplicates
+            if self._mark and server_path not in self._files_original:
+                self._mark_originals.add(server_path)
+            self._files_original.add(server_path)
         duplicates = self._files_duplicate[key]
 
         if 2 == len(duplicates) or not local_mode:
             flag = True
-            duplicates.append(client_path)
+            if local_mode or not self._report:
+                duplicates.append(client_path)
         elif local_mode:
             files = duplicates[1:]
             head = len(f"original@{server_id}:")
@@ -103,6 +303,16 @@ class ShrinkStat:
                 duplicates.append(client_path)
 
         if flag:
+            if self._report:
+                record = {
+                    "key": key,
+                    "size": free_space,
+                    "original": duplicates[1],
+                    "copy": client_path,
+                }
+                self._report.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._report.flush()
+
             self._deleted += 1
             self._shrink_bytes += free_space
 
@@ -123,27 +333,30 @@ class ShrinkStat:
     def on_scan(self, scaned: int = 1):
         self._scaned += scaned
 
-    def reach_limit(self) -> bool:
-        return (self._limit_scan > 0 and self._scaned >= self._limit_scan) or (
+    @property
+    def scan_left(self) -> Optional[int]:
+        # 扫描数量限制内剩余的文件数，没有限制时为 None
+        if self._limit_scan <= 0:
+            return None
+
+        return max(self._limit_scan - self._scaned, 0)
+
+    def reach_limit(self, *, scan: bool = True) -> bool:
+        # scan: 是否检查扫描数量的限制
+        return (scan and self._limit_scan > 0 and self._scaned >= self._limit_scan) or (
             self._limit_delete > 0 and self._deleted >= self._limit_delete
         )
 
     def on_hash(self, size: int):
-        self._hash_bytes += size
+        with self._hash_lock:
+            self._hash_bytes += size
 
     @property
     def hash_bytes(self):
         return self._hash_bytes
 
     def skip_scan(self, path: str) -> bool:
-        for duplicate in self.files_duplicate.values():
-            file = duplicate[1]
-            file = re.sub(r"^original@\w+:", "", duplicate[1])
-
-            if path == file:
-                return True
-
-        return False
+        return path in self._files_original
 
     @property
     def files_to_scan(self) -> int:
@@ -161,6 +374,99 @@ class ShrinkStat:
         self._deleted += 1
         self._shrink_bytes += free_space
 
+    def use_size_group(self, size_group: Dict[int, List[str]]):
+        # 多进程扫描时每个 worker 只处理一部分 size group
+        self._size_group = size_group
+        self._important_files = sum(len(files) for files in size_group.values())
+
+    def merge(self, checkpoint: Dict):
+        # 合并 worker 的结果，各 worker 的 size group 不重叠
+        self._scaned += checkpoint["scaned"]
+        self._deleted += checkpoint["deleted"]
+        self._shrink_bytes += checkpoint["shrink_bytes"]
+        self._hash_bytes += checkpoint["hash_bytes"]
+        self._files_errors.extend(checkpoint["error"])
+        self._files_duplicate.update(checkpoint["duplicate"])
+        self._files_original.update(checkpoint["original"])
+        for ext in checkpoint["extensions"]:
+            if ext not in self._files_ext:
+                self._files_ext.append(ext)
+
+    def open_report(self, path: str, *, offset: Optional[int] = None):
+        # offset: 恢复扫描时截断到上次 checkpoint 的位置，丢弃未完成的 size group
+        self._report = open(path, "a", encoding="utf-8")
+        if offset is not None:
+            self._report.truncate(offset)
+
+    def close_report(self):
+        if self._report:
+            self._report.close()
+            self._report = None
+
+    @property
+    def report_offset(self) -> Optional[int]:
+        return self._report.tell() if self._report else None
+
+    def mark(self):
+        # 记录 size group 之间的边界
+        self._mark = {
+            "scaned": self._scaned,
+            "deleted": self._deleted,
+            "shrink_bytes": self._shrink_bytes,
+            "hash_bytes": self._hash_bytes,
+            "error": len(self._files_errors),
+            "extensions": len(self._files_ext),
+            "report_offset": self.report_offset,
+        }
+        self._mark_duplicates = {}
+        self._mark_originals = set()
+
+    @property
+    def marked_report_offset(self) -> Optional[int]:
+        return self._mark["report_offset"] if self._mark else self.report_offset
+
+    def checkpoint(self, *, at_mark: bool = False) -> Dict:
+        # 扫描进度，只在 size group 处理完成后保存，0 字节文件由 group_by_size 重新统计；
+        # at_mark: 不包含最近的边界之后未完成的 size group
+        if at_mark and self._mark:
+            duplicates = {}
+            for key, files in self._files_duplicate.items():
+                length = self._mark_duplicates.get(key, len(files))
+                if length > 0:
+                    duplicates[key] = files[:length]
+
+            return {
+                "scaned": self._mark["scaned"],
+                "deleted": self._mark["deleted"],
+                "shrink_bytes": self._mark["shrink_bytes"],
+                "hash_bytes": self._mark["hash_bytes"],
+                "error": self._files_errors[: self._mark["error"]],
+                "duplicate": duplicates,
+                "original": sorted(self._files_original - self._mark_originals),
+                "extensions": self._files_ext[: self._mark["extensions"]],
+            }
+
+        return {
+            "scaned": self._scaned,
+            "deleted": self._deleted,
+            "shrink_bytes": self._shrink_bytes,
+            "hash_bytes": self._hash_bytes,
+            "error": self._files_errors,
+            "duplicate": self._files_duplicate,
+            "original": sorted(self._files_original),
+            "extensions": self._files_ext,
+        }
+
+    def restore(self, checkpoint: Dict):
+        self._scaned = checkpoint["scaned"]
+        self._deleted = checkpoint["deleted"]
+        self._shrink_bytes = checkpoint["shrink_bytes"]
+        self._hash_bytes = checkpoint["hash_bytes"]
+        self._files_errors = list(checkpoint["error"])
+        self._files_duplicate = dict(checkpoint["duplicate"])
+        self._files_original = set(checkpoint["original"])
+        self._files_ext = list(checkpoint["extensions"])
+
     def _update_extension(self, path: str):
         _, ext = os.path.splitext(path)
         if ext:
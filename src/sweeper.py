@@ -1,14 +1,33 @@
-import json
+import asyncio
 import os
 import socket
 import struct
 import traceback
+from collections import deque
 from enum import IntEnum
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import yaml
 
-from src import ChunkHash, Command, HashDB, Key, ShrinkStat, Util
+from src import (
+    CODECS,
+    COMPRESSORS,
+    ChunkHash,
+    Command,
+    HashDB,
+    Key,
+    ShrinkStat,
+    Util,
+)
+
+# 超过该长度的消息才尝试压缩
+COMPRESS_THRESHOLD = 4096
+# 单个消息（解压后）的最大长度
+MAX_FRAME_SIZE = 1024 * 1024 * 1024
+# 当前版本支持的协议扩展，握手时协商
+# delta: CHECK_HASH 只发送新增的分段 hash，服务器按 request_id 保存已匹配的部分
+# heads: CHECK_HEADS 一次比较一组相同大小文件的首块 hash
+FEATURES = ["delta", "heads"]
 
 
 class Role(IntEnum):
@@ -18,6 +37,41 @@ class Role(IntEnum):
 
 
 class MessageBuilder:
+    def req_hello(
+        self,
+        *,
+        device_id: str,
+        wire_formats: List[str],
+        compressions: List[str],
+        features: List[str],
+    ) -> Dict:
+        return {
+            Key.COMMAND: Command.HELLO,
+            Key.DEVICE_ID: device_id,
+            Key.REQUEST_ID: f"{device_id}-hello",
+            Key.WIRE_FORMAT: wire_formats,
+            Key.COMPRESSION: compressions,
+            Key.FEATURES: features,
+        }
+
+    def echo_hello(
+        self,
+        *,
+        device_id: str,
+        request_id,
+        wire_format: str,
+        compression: str,
+        features: List[str],
+    ) -> Dict:
+        return {
+            Key.COMMAND: Command.ECHO_HELLO,
+            Key.DEVICE_ID: device_id,
+            Key.REQUEST_ID: request_id,
+            Key.RESULT: wire_format,
+            Key.COMPRESSION: compression,
+            Key.FEATURES: features,
+        }
+
     def req_size(
         self, *, device_id: str, request_id, local_mode: bool, path: str, size: int
     ) -> Dict:
@@ -39,6 +93,53 @@ class MessageBuilder:
             Key.RESULT: files,
         }
 
+    def req_sizes(self, *, device_id: str, request_id, sizes: List[int]) -> Dict:
+        return {
+            Key.COMMAND: Command.CHECK_SIZES,
+            Key.DEVICE_ID: device_id,
+            Key.REQUEST_ID: request_id,
+            Key.SIZES: sizes,
+        }
+
+    # files: [[size, files], ...] 只包含服务器上存在的文件大小
+    def echo_sizes(self, *, device_id: str, request_id, files: List) -> Dict:
+        return {
+            Key.COMMAND: Command.ECHO_CHECK_SIZES,
+            Key.DEVICE_ID: device_id,
+            Key.REQUEST_ID: request_id,
+            Key.RESULT: files,
+        }
+
+    # hashes: 每个文件的首块 hash，paths: 本地模式下对应的文件路径
+    def req_heads(
+        self,
+        *,
+        device_id: str,
+        request_id,
+        local_mode: bool,
+        size: int,
+        chunk_hashes: List,
+        paths: Optional[List[str]],
+    ) -> Dict:
+        return {
+            Key.COMMAND: Command.CHECK_HEADS,
+            Key.DEVICE_ID: device_id,
+            Key.REQUEST_ID: request_id,
+            Key.LOCAL_MODE: local_mode,
+            Key.SIZE: size,
+            Key.HASH: chunk_hashes,
+            Key.PATHS: paths,
+        }
+
+    # files: [[index, path], ...] 只包含首块 hash 相同的文件，path 为服务器上的候选文件
+    def echo_heads(self, *, device_id: str, request_id, files: List) -> Dict:
+        return {
+            Key.COMMAND: Command.ECHO_CHECK_HEADS,
+            Key.DEVICE_ID: device_id,
+            Key.REQUEST_ID: request_id,
+            Key.RESULT: files,
+        }
+
     def req_hash(
         self,
         *,
@@ -48,6 +149,7 @@ class MessageBuilder:
         path: str,
         size: int,
         chunk_hashes: List,
+        delta: bool = False,
     ) -> Dict:
         return {
             Key.COMMAND: Command.CHECK_HASH,
@@ -57,14 +159,19 @@ class MessageBuilder:
             Key.PATH: path,
             Key.SIZE: size,
             Key.HASH: chunk_hashes,
+            Key.DELTA: delta,
         }
 
-    def echo_hash(self, *, device_id: str, request_id, path: str) -> Dict:
+    # resync: 服务器没有该 request_id 已匹配的分段 hash，客户端需要重发完整列表
+    def echo_hash(
+        self, *, device_id: str, request_id, path: str, resync: bool = False
+    ) -> Dict:
         return {
             Key.COMMAND: Command.ECHO_CHECK_HASH,
             Key.DEVICE_ID: device_id,
             Key.REQUEST_ID: request_id,
             Key.RESULT: path,
+            Key.RESYNC: resync,
         }
 
     def req_calc_file_hash(
@@ -89,18 +196,90 @@ class MessageBuilder:
 
 
 class Messanger:
-    def __init__(self, device_id: str, socket: socket.socket, debug_mode: bool):
+    def __init__(
+        self,
+        device_id: str,
+        socket: socket.socket,
+        debug_mode: bool,
+        *,
+        max_frame: int = MAX_FRAME_SIZE,
+    ):
         self._device_id = device_id
         self._socket = socket
         self._debug_mode = debug_mode
+        self._max_frame = max_frame
+
+        # 握手前及握手失败时使用 JSON
+        self._codec = CODECS["json"]
+        # 协商压缩后帧头增加 1 字节标记，0 表示未压缩
+        self._compressor = None
+        self.features: List[str] = []
+        # 握手后得到的对端 id
+        self.peer_id: Optional[str] = None
+
+        self.bytes_sent = self.bytes_received = 0
+        self.payload_sent = self.payload_received = 0
+
+    @property
+    def wire_format(self) -> str:
+        return self._codec.name
+
+    @property
+    def compression(self) -> Optional[str]:
+        return self._compressor.name if self._compressor else None
+
+    def use_wire_format(self, wire_format: str, compression: Optional[str] = None):
+        self._codec = CODECS[wire_format]
+        self._compressor = COMPRESSORS[compression] if compression else None
+
+    def handshake(self, wire_formats: List[str], compressions: List[str]) -> bool:
+        # 客户端按优先级提出编码格式，服务器选择其中第一个支持的
+        msg = MessageBuilder().req_hello(
+            device_id=self._device_id,
+            wire_formats=wire_formats,
+            compressions=compressions,
+            features=FEATURES,
+        )
+        if not self.send_json(msg):
+            return False
+
+        echo_message = self.recv_json()
+        if not (
+            echo_message
+            and Command.ECHO_HELLO == echo_message.get(Key.COMMAND, None)
+            and echo_message.get(Key.RESULT, None) in CODECS
+            and echo_message.get(Key.COMPRESSION, None) in [None, *COMPRESSORS]
+        ):
+            Util.debug("unexpected echo message", fmt_indent=3, fmt_time=True)
+            return False
+
+        self.use_wire_format(echo_message[Key.RESULT], echo_message[Key.COMPRESSION])
+        self.peer_id = echo_message.get(Key.DEVICE_ID, None)
+        self.features = [
+            feature
+            for feature in echo_message.get(Key.FEATURES, None) or []
+            if feature in FEATURES
+        ]
+        Util.debug(
+            f"wire format: {self.wire_format}, compression: {self.compression}, features: {self.features}",
+            fmt_time=True,
+        )
+
+        return True
+
+    def fileno(self) -> int:
+        return self._socket.fileno()
+
+    @property
+    def buffered(self) -> bool:
+        # 是否有已经收到、不需要等待 socket 的回复
+        return False
 
     def send_json(self, message: Dict) -> bool:
         try:
-            raw = json.dumps(message).encode()
-            self._socket.sendall(struct.pack("!I", len(raw)) + raw)
-
-            if self._debug_mode:
-                self._debug_socket_data(message, send=True)
+            frame = self._pack(message)
+            self._socket.sendall(frame)
+            self._on_sent(message, frame)
 
             return True
         except Exception:
@@ -109,27 +288,99 @@ class Messanger:
 
     def recv_json(self) -> Dict:
         try:
-            raw_len = self._socket.recv(4)
-            if not raw_len:
+            head = self._recv_exact(self._head_size)
+            if not head:
                 return None
 
-            data = b""
-            to_read = struct.unpack("!I", raw_len)[0]
-            while len(data) < to_read:
-                chunk = self._socket.recv(to_read - len(data))
-                if not chunk:
-                    return None
-                data += chunk
+            to_read, flag = self._parse_head(head)
+            if to_read is None:
+                return None
 
-            message = json.loads(data.decode())
-            if self._debug_mode:
-                self._debug_socket_data(message, send=False)
+            data = self._recv_exact(to_read)
+            if data is None:
+                return None
 
-            return message
+            return self._unpack(data, flag)
         except Exception:
             traceback.print_exc()
             return None
 
+    @property
+    def _head_size(self) -> int:
+        return 5 if self._compressor else 4
+
+    def _pack(self, message: Dict) -> bytes:
+        raw = self._codec.encode(message)
+        self.payload_sent += len(raw)
+
+        if self._compressor:
+            flag = 0
+            if len(raw) > COMPRESS_THRESHOLD:
+                compressed = self._compressor.compress(raw)
+                if len(compressed) < len(raw):
+                    raw, flag = compressed, self._compressor.flag
+            return struct.pack("!IB", len(raw), flag) + raw
+
+        return struct.pack("!I", len(raw)) + raw
+
+    def _on_sent(self, message: Dict, frame: bytes):
+        self.bytes_sent += len(frame)
+
+        if self._debug_mode:
+            self._debug_socket_data(message, send=True)
+
+    def _parse_head(self, head: bytes) -> Tuple[Optional[int], int]:
+        flag = 0
+        if self._compressor:
+            to_read, flag = struct.unpack("!IB", head)
+        else:
+            to_read = struct.unpack("!I", head)[0]
+
+        # 异常的帧长度说明数据流已经错位，不能继续使用该连接
+        if to_read > self._max_frame:
+            Util.debug(
+                f"frame too large: {Util.readable_size(to_read)}, connection closed",
+                fmt_time=True,
+            )
+            self.close()
+            return None, flag
+
+        return to_read, flag
+
+    def _unpack(self, data: bytes, flag: int) -> Dict:
+        self.bytes_received += self._head_size + len(data)
+
+        if flag:
+            data = self._decompressor(flag).decompress(data, self._max_frame)
+        self.payload_received += len(data)
+
+        message = self._codec.decode(data)
+        if self._debug_mode:
+            self._debug_socket_data(message, send=False)
+
+        return message
+
+    def _recv_exact(self, size: int) -> Optional[bytearray]:
+        # 预分配缓冲区，recv_into 直接写入，避免 bytes 拼接的二次复制
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+
+        received = 0
+        while received < size:
+            chunk = self._socket.recv_into(view[received:], size - received)
+            if not chunk:
+                return None
+            received += chunk
+
+        return buffer
+
+    def _decompressor(self, flag: int):
+        for compressor in COMPRESSORS.values():
+            if flag == compressor.flag:
+                return compressor
+
+        raise ValueError(f"unsupported compression flag: {flag}")
+
     def _debug_socket_data(
         self, data: Dict, *, send: bool, fmt_indent: int = 0, fmt_time: bool = True
     ):
@@ -162,6 +413,142 @@ class Messanger:
             pass
 
 
+class AsyncMessanger(Messanger):
+    # asyncio 连接使用，帧格式与 Messanger 相同，send_json / recv_json 为协程
+    def __init__(
+        self,
+        device_id: str,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        debug_mode: bool,
+        *,
+        max_frame: int = MAX_FRAME_SIZE,
+    ):
+        super().__init__(device_id, None, debug_mode, max_frame=max_frame)
+
+        self._reader = reader
+        self._writer = writer
+
+    async def send_json(self, message: Dict) -> bool:
+        try:
+            frame = self._pack(message)
+            self._writer.write(frame)
+            await self._writer.drain()
+            self._on_sent(message, frame)
+
+            return True
+        except Exception:
+            traceback.print_exc()
+            return False
+
+    async def recv_json(self) -> Dict:
+        try:
+            head = await self._reader.readexactly(self._head_size)
+
+            to_read, flag = self._parse_head(head)
+            if to_read is None:
+                return None
+
+            return self._unpack(await self._reader.readexactly(to_read), flag)
+        except asyncio.IncompleteReadError:
+            return None
+        except Exception:
+            traceback.print_exc()
+            return None
+
+    def close(self) -> Any:
+        try:
+            self._writer.close()
+        except Exception:
+            pass
+
+
+class LoopbackMessanger(Messanger):
+    # 同一进程内的连接，请求直接交给 handler 处理，不经过 socket 和编码
+    def __init__(
+        self,
+        device_id: str,
+        handler: Callable[[Dict], Optional[Dict]],
+        debug_mode: bool,
+    ):
+        super().__init__(device_id, None, debug_mode)
+
+        self._handler = handler
+        self._replies = deque()
+
+    @property
+    def buffered(self) -> bool:
+        return len(self._replies) > 0
+
+    def send_json(self, message: Dict) -> bool:
+        try:
+            if self._debug_mode:
+                self._debug_socket_data(message, send=True)
+
+            reply = self._handler(message)
+            if not reply:
+                return False
+
+            self._replies.append(reply)
+            return True
+        except Exception:
+            traceback.print_exc()
+            return False
+
+    def recv_json(self) -> Dict:
+        if not self._replies:
+            return None
+
+        message = self._replies.popleft()
+        if self._debug_mode:
+            self._debug_socket_data(message, send=False)
+
+        return message
+
+
+class Pipeline:
+    # 在一个连接上保持最多 window 个未完成的请求，按 request_id 分发回复
+    def __init__(self, messanger: Messanger, window: int = 1):
+        self._messanger = messanger
+        self._window = max(window, 1)
+
+        # key: request id, value: echo handler
+        self._pending: Dict[str, Callable[[Dict], None]] = {}
+
+    @property
+    def full(self) -> bool:
+        return len(self._pending) >= self._window
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def send(self, message: Dict, on_echo: Callable[[Dict], None]) -> bool:
+        while self.full:
+            if not self.poll():
+                return False
+
+        if not self._messanger.send_json(message):
+            return False
+
+        self._pending[message[Key.REQUEST_ID]] = on_echo
+        return True
+
+    def poll(self) -> bool:
+        # 接收一条回复并交给对应请求的 handler，连接断开时返回 False
+        echo_message = self._messanger.recv_json()
+        if not echo_message:
+            return False
+
+        on_echo = self._pending.pop(echo_message.get(Key.REQUEST_ID, None), None)
+        if not on_echo:
+            Util.debug(f"unexpected echo message [{str(echo_message)}]", fmt_time=True)
+            return True
+
+        on_echo(echo_message)
+        return True
+
+
 class Storage:
     def __init__(
         self,
@@ -201,10 +588,30 @@ class Storage:
             else f"{self._role.name}-{Util.random_string()}"
         )
 
-        key = "bind" if self._role == Role.SERVER else "server"
-        address = config[key].split(":")
-        self._host = address[0]
-        self._port = int(address[1]) if len(address) == 2 else 5555
+        # 扫描端可以配置多个服务器；进程内的服务器没有 bind，使用扫描端的配置
+        key = "bind" if self._role == Role.SERVER and "bind" in config else "server"
+        self._servers: List[Tuple[str, int]] = []
+        for server in config[key] if isinstance(config[key], list) else [config[key]]:
+            address = server.split(":")
+            self._servers.append(
+                (address[0], int(address[1]) if len(address) == 2 else 5555)
+            )
+        self._host, self._port = self._servers[0]
+
+        # 客户端优先使用的编码格式，JSON 作为调试及回退格式
+        wire_format = config.get("wire_format", "binary")
+        self._wire_formats = [wire_format]
+        if "json" != wire_format:
+            self._wire_formats.append("json")
+
+        # 客户端可接受的压缩算法，none 表示不压缩
+        compression = config.get("compression", "auto")
+        if "auto" == compression:
+            self._compressions = list(COMPRESSORS.keys())
+        elif "none" == compression:
+            self._compressions = []
+        else:
+            self._compressions = [compression]
 
         self._ch = ChunkHash()
 
@@ -235,7 +642,9 @@ class Sweeper(Storage):
         super()._parse_yaml(config)
 
         pwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        self._db = HashDB(os.path.join(pwd, config["hash_db"]))
+        self._db_path = os.path.join(pwd, config["hash_db"])
+        # 服务器在 executor 线程中计算 hash，需要跨线程共享连接
+        self._db = HashDB(self._db_path, shared=Role.SERVER == self._role)
 
     def stop(self) -> Any:
         if self._messanger:
@@ -252,34 +661,49 @@ class Sweeper(Storage):
             )
 
     def _file_details(
-        self, *, path: str, size: int, mtime: float, request_id, ref_hashes: List = None
+        self,
+        *,
+        path: str,
+        size: int,
+        mtime: float,
+        request_id,
+        ref_hashes: List = None,
+        ref_verified: int = 0,
     ) -> Optional[Tuple[int, List]]:
-        fid, chunk_hashes = self._db.get_file_details(path=path, size=size, mtime=mtime)
-
-        if -1 == fid:
-            fid = self._db.add_file(
-                path=os.path.dirname(path),
-                name=os.path.basename(path),
-                size=size,
-                mtime=mtime,
+        # ref_verified: ref_hashes 中已经与本文件比较过的分段数
+        # 查询或添加文件记录作为整体执行，其他线程不会同时添加同一个文件
+        with self._db.lock:
+            fid, chunk_hashes = self._db.get_file_details(
+                path=path, size=size, mtime=mtime
             )
-            if -1 != fid:
-                Util.debug(
-                    f"{os.path.basename(path)}-{request_id}",
-                    fmt_time=True,
+
+            if -1 == fid:
+                fid = self._db.add_file(
+                    path=os.path.dirname(path),
+                    name=os.path.basename(path),
+                    size=size,
+                    mtime=mtime,
                 )
+                if -1 != fid:
+                    Util.debug(
+                        f"{os.path.basename(path)}-{request_id}",
+                        fmt_time=True,
+                    )
 
-        if not Util.is_serial_hashes(chunk_hashes):
-            chunk_hashes = None
-            if -1 != fid:
-                self._db.delete_chunk_hashes(fid)
+            if not Util.is_serial_hashes(chunk_hashes):
+                chunk_hashes = None
+                if -1 != fid:
+                    self._db.delete_chunk_hashes(fid)
 
         blocks = self._ch.blocks(size)
         max_serial = 1 if not ref_hashes else min(len(ref_hashes), blocks)
 
         if chunk_hashes and ref_hashes:
             serial = min(len(chunk_hashes), len(ref_hashes))
-            if not self._equal_chunk_hashes(chunk_hashes[:serial], ref_hashes[:serial]):
+            verified = min(ref_verified, serial)
+            if not self._equal_chunk_hashes(
+                chunk_hashes[verified:serial], ref_hashes[verified:serial]
+            ):
                 return fid, chunk_hashes
 
         if not chunk_hashes or len(chunk_hashes) < max_serial:
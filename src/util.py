@@ -46,12 +46,14 @@ class Util:
         print(f"{head}{content}", **kwargs)
 
     @staticmethod
-    def is_serial_hashes(chunk_hashes: List, *, null_as_serial: bool = True) -> bool:
+    def is_serial_hashes(
+        chunk_hashes: List, *, null_as_serial: bool = True, start: int = 1
+    ) -> bool:
         if chunk_hashes:
             for i, hash in enumerate(chunk_hashes):
                 if (
                     not isinstance(hash, dict)
-                    or (i + 1) != hash.get("serial", -1)
+                    or (i + start) != hash.get("serial", -1)
                     or "block_size" not in hash
                     or "hash" not in hash
                 ):
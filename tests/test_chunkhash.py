@@ -1,6 +1,7 @@
 import os
 import random
 import subprocess
+import threading
 import unittest
 
 from src.chunk_hash import BLOCK_SIZE, HEAD_SIZE, READ_SIZE, ChunkHash
@@ -92,6 +93,35 @@ class TestChunkHash(unittest.TestCase):
 
             print(f"{os.path.basename(path)}: {hash2}")
 
+    def test_file_hash_cancel(self):
+        path = self._create_file(size=HEAD_SIZE, id=self._file_id)
+        self._file_id += 1
+
+        cancel = threading.Event()
+        self.assertIsNotNone(self._ch.file_hash(path, cancel=cancel))
+        cancel.set()
+        self.assertIsNone(self._ch.file_hash(path, cancel=cancel))
+
+    def test_same_files(self):
+        size = READ_SIZE * 2 + 1
+        paths = []
+        for _ in range(4):
+            paths.append(self._create_file(size=size, id=self._file_id))
+            self._file_id += 1
+
+        with open(paths[0], "rb") as f:
+            data = f.read()
+        for path in paths[1:3]:
+            with open(path, "wb") as f:
+                f.write(data)
+        # 只有最后一个字节不同
+        with open(paths[2], "r+b") as f:
+            f.seek(size - 1)
+            f.write(bytes([data[-1] ^ 1]))
+
+        self.assertEqual([paths[1]], self._ch.same_files(paths[0], paths[1:]))
+        self.assertEqual([], self._ch.same_files(paths[3], paths[:3]))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from src.dir_watch import DirWatcher, InotifyWatcher, PollWatcher
+
+
+class TestDirWatcher(unittest.TestCase):
+    def setUp(self):
+        self._dir_temp = tempfile.mkdtemp(prefix="dir_watch_")
+
+        self.changed = []
+        self._changed = threading.Event()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir_temp)
+
+    def _on_change(self, path: str):
+        self.changed.append(path)
+        self._changed.set()
+
+    def _create_file(self, *names: str) -> str:
+        path = os.path.join(self._dir_temp, *names)
+        with open(path, "wb") as f:
+            f.write(b"1")
+
+        return path
+
+    def test_poll(self):
+        self._create_file("keep.bin")
+        gone = self._create_file("gone.bin")
+        watcher = PollWatcher([self._dir_temp], self._on_change, interval=0.1)
+        watcher._poll(self._dir_temp, notify=False)
+
+        # 新建、删除文件和新建目录，新目录中的文件逐个通知
+        added = self._create_file("added.bin")
+        os.remove(gone)
+        os.makedirs(os.path.join(self._dir_temp, "sub"))
+        sub_file = self._create_file("sub", "1.bin")
+        watcher._poll(self._dir_temp, notify=True)
+        self.assertEqual(sorted([added, gone, sub_file]), sorted(self.changed))
+
+        # 没有变化时不通知
+        self.changed.clear()
+        watcher._poll(self._dir_temp, notify=True)
+        self.assertEqual([], self.changed)
+
+        watcher.start()
+        watcher.stop()
+        watcher.join(5)
+        self.assertFalse(watcher.is_alive())
+
+    def test_stop(self):
+        watcher = DirWatcher.create([self._dir_temp], self._on_change, interval=0.1)
+        if not isinstance(watcher, InotifyWatcher):
+            self.skipTest("inotify unavailable")
+        watcher.start()
+
+        path = os.path.join(self._dir_temp, "1.bin")
+        with open(path, "wb") as f:
+            f.write(b"1")
+        self.assertTrue(self._changed.wait(5))
+        self.assertIn(path, self.changed)
+
+        # 没有事件时线程也能结束
+        watcher.stop()
+        watcher.join(5)
+        self.assertFalse(watcher.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
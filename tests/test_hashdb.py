@@ -117,6 +117,32 @@ class TestFileHashDB(unittest.TestCase):
         self.assertEqual(fid, fid1)
         self.assertIsNone(chunk_hashes)
 
+    def test_dir_snapshot(self):
+        entries = [("a.txt", False, 100, 0o100644), ("sub", True, 0, 0)]
+        self.assertTrue(
+            self.db.save_dir_snapshot(path="/tmp/snap", mtime=123, entries=entries)
+        )
+        self.assertTrue(
+            self.db.save_dir_snapshot(path="/tmp/snap/sub", mtime=456, entries=[])
+        )
+
+        mtime, queried = self.db.get_dir_snapshot("/tmp/snap")
+        self.assertEqual(123, mtime)
+        self.assertEqual(entries, queried)
+
+        # 重复保存覆盖旧快照
+        self.assertTrue(
+            self.db.save_dir_snapshot(path="/tmp/snap", mtime=789, entries=entries[:1])
+        )
+        mtime, queried = self.db.get_dir_snapshot("/tmp/snap")
+        self.assertEqual(789, mtime)
+        self.assertEqual(entries[:1], queried)
+
+        # 删除目录时子目录快照级联删除
+        self.assertTrue(self.db.delete_dir_snapshots("/tmp/snap"))
+        self.assertIsNone(self.db.get_dir_snapshot("/tmp/snap"))
+        self.assertIsNone(self.db.get_dir_snapshot("/tmp/snap/sub"))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+
+from src.head_index import HeadIndex
+
+
+class TestHeadIndex(unittest.TestCase):
+    def setUp(self):
+        self.heads = {"/a/1": "h1", "/a/2": "h2", "/a/3": "h1", "/a/4": None}
+        self.hashed = []
+
+    def _head_of(self, path: str):
+        self.hashed.append(path)
+        return self.heads[path]
+
+    def test_lookup(self):
+        index = HeadIndex()
+        files = ["/a/1", "/a/2", "/a/3", "/a/4"]
+
+        self.assertEqual(
+            ["/a/1", "/a/3"], index.lookup(4096, "h1", files, self._head_of)
+        )
+        self.assertEqual(files, self.hashed)
+
+        # 已经建立索引，不再计算
+        self.assertEqual(["/a/2"], index.lookup(4096, "h2", files, self._head_of))
+        self.assertEqual([], index.lookup(4096, "h3", files, self._head_of))
+        self.assertEqual(4, len(self.hashed))
+
+    def test_refresh(self):
+        index = HeadIndex()
+        files = ["/a/1", "/a/2", "/a/3"]
+        index.lookup(4096, "h1", files, self._head_of)
+
+        # 文件变化后只重新计算变化的文件
+        self.heads["/a/3"] = "h2"
+        index.discard("/a/3")
+        index.invalidate(4096)
+        self.hashed.clear()
+
+        self.assertEqual(
+            ["/a/2", "/a/3"], index.lookup(4096, "h2", files, self._head_of)
+        )
+        self.assertEqual(["/a/3"], self.hashed)
+
+        index.discard("/a/1")
+        self.assertEqual([], index.lookup(4096, "h1", files[1:], self._head_of))
+
+    def test_update(self):
+        index = HeadIndex()
+        files = ["/a/1", "/a/2", "/a/3"]
+        index.lookup(4096, "h1", files, self._head_of)
+
+        # 原地改写的文件按新的首块查询，不重新计算其他文件
+        index.update(4096, "/a/3", "h2")
+        index.update(4096, "/a/4", "h2")
+        self.hashed.clear()
+        self.assertEqual(
+            ["/a/2", "/a/3"], index.lookup(4096, "h2", files, self._head_of)
+        )
+        self.assertEqual(["/a/1"], index.lookup(4096, "h1", files, self._head_of))
+        self.assertEqual([], self.hashed)
+
+
+if __name__ == "__main__":
+    unittest.main()
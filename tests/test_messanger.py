@@ -0,0 +1,291 @@
+import asyncio
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import yaml
+
+import scanner
+from server import Server
+from src import (
+    CODECS,
+    AsyncMessanger,
+    COMPRESSORS,
+    Command,
+    Key,
+    LoopbackMessanger,
+    MessageBuilder,
+    Messanger,
+    Pipeline,
+)
+
+
+class TestMessanger(unittest.TestCase):
+    def setUp(self):
+        self._client_socket, self._server_socket = socket.socketpair()
+        self.client = Messanger("client", self._client_socket, False)
+        self.server = Messanger("server", self._server_socket, False)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+    def test_pipeline_out_of_order(self):
+        pipeline = Pipeline(self.client, 3)
+        echoes = []
+
+        for i in range(3):
+            self.assertTrue(
+                pipeline.send(
+                    {Key.REQUEST_ID: f"r{i}", Key.SIZE: i},
+                    lambda echo, i=i: echoes.append((i, echo[Key.RESULT])),
+                )
+            )
+        self.assertTrue(pipeline.full)
+
+        # 服务器按相反顺序回复
+        requests = [self.server.recv_json() for _ in range(3)]
+        for request in reversed(requests):
+            self.server.send_json(
+                {Key.REQUEST_ID: request[Key.REQUEST_ID], Key.RESULT: request[Key.SIZE]}
+            )
+
+        while pipeline.pending > 0:
+            self.assertTrue(pipeline.poll())
+
+        self.assertEqual([(2, 2), (1, 1), (0, 0)], echoes)
+        self.assertFalse(pipeline.full)
+
+    def test_binary_codec(self):
+        builder = MessageBuilder()
+        chunk_hashes = [
+            {
+                "serial": 1,
+                "block_size": 131072,
+                "hash": "e6c2bf57202263f317c4728fe8ce9f44",
+            },
+            {"serial": 2, "block_size": 67108864, "hash": "0" * 32},
+        ]
+        messages = [
+            builder.req_hash(
+                device_id="client",
+                request_id="a1b2-x",
+                local_mode=True,
+                path="/data/文件/ab.bin",
+                size=2**40 + 3,
+                chunk_hashes=chunk_hashes,
+            ),
+            builder.req_hash(
+                device_id="client",
+                request_id="a1b2-x",
+                local_mode=False,
+                path="/data/ab.bin",
+                size=2**40 + 3,
+                chunk_hashes=chunk_hashes[1:],
+                delta=True,
+            ),
+            builder.echo_hash(device_id="server", request_id="abcd", path=None),
+            builder.echo_hash(
+                device_id="server", request_id="abcd", path=None, resync=True
+            ),
+            builder.echo_sizes(
+                device_id="server", request_id="r", files=[[1, 2], [3, 4]]
+            ),
+            {Key.COMMAND: Command.CHECK_SIZE, "other": {"x": -7, "y": 1.5, "z": []}},
+        ]
+
+        binary, json = CODECS["binary"], CODECS["json"]
+        for message in messages:
+            raw = binary.encode(message)
+            self.assertEqual(json.decode(json.encode(message)), binary.decode(raw))
+            self.assertLess(len(raw), len(json.encode(message)))
+
+    def test_handshake(self):
+        def serve():
+            request = self.server.recv_json()
+            self.assertEqual(Command.HELLO, request[Key.COMMAND])
+            self.server.send_json(
+                MessageBuilder().echo_hello(
+                    device_id="server",
+                    request_id=request[Key.REQUEST_ID],
+                    wire_format=request[Key.WIRE_FORMAT][0],
+                    compression=request[Key.COMPRESSION][0],
+                    features=request[Key.FEATURES],
+                )
+            )
+            self.server.use_wire_format(
+                request[Key.WIRE_FORMAT][0], request[Key.COMPRESSION][0]
+            )
+            self.server.send_json(self.server.recv_json())
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+
+        self.assertTrue(self.client.handshake(["binary", "json"], ["zlib"]))
+        self.assertEqual("binary", self.client.wire_format)
+        self.assertEqual("zlib", self.client.compression)
+        self.assertEqual(["delta", "heads"], self.client.features)
+
+        # 大消息压缩后传输
+        sizes = list(range(0, 200000, 7))
+        self.assertTrue(self.client.send_json({Key.REQUEST_ID: "r", Key.SIZES: sizes}))
+        self.assertEqual({"request_id": "r", "sizes": sizes}, self.client.recv_json())
+        self.assertLess(self.client.bytes_sent * 2, self.client.payload_sent)
+        thread.join()
+
+    def test_async_messanger(self):
+        sizes = list(range(0, 200000, 7))
+
+        async def serve():
+            reader, writer = await asyncio.open_connection(sock=self._server_socket)
+            server = AsyncMessanger("server", reader, writer, False)
+            server.use_wire_format("binary", "zlib")
+
+            request = await server.recv_json()
+            self.assertTrue(await server.send_json(request))
+            self.assertIsNone(await server.recv_json())
+            server.close()
+
+        # 阻塞的 Messanger 与 asyncio 端使用相同的帧格式
+        def client():
+            self.client.use_wire_format("binary", "zlib")
+            self.client.send_json({Key.REQUEST_ID: "r", Key.SIZES: sizes})
+            echoes.append(self.client.recv_json())
+            self._client_socket.shutdown(socket.SHUT_WR)
+
+        echoes = []
+        thread = threading.Thread(target=client)
+        thread.start()
+        asyncio.run(serve())
+        thread.join()
+
+        self.assertEqual([{"request_id": "r", "sizes": sizes}], echoes)
+
+    def test_inquire_sizes(self):
+        with tempfile.TemporaryDirectory(prefix="sizes_") as dir_temp:
+            yaml_file = os.path.join(dir_temp, "sweeper.yaml")
+            with open(yaml_file, "w", encoding="utf-8") as f:
+                yaml.safe_dump(
+                    {
+                        "id": "test",
+                        "server": "127.0.0.1:5555",
+                        "bind": "127.0.0.1:5555",
+                        "hash_db": os.path.join(dir_temp, "hash.db"),
+                        "sweep_dirs": [dir_temp],
+                    },
+                    f,
+                )
+
+            server = Server(yaml_file, debug_mode=False)
+            client = scanner.Scanner(
+                yaml_file, local_mode=False, debug_mode=False, limit=(0, 0)
+            )
+            client._prefetcher.shutdown()
+            server._stat.use_size_group({200: ["a", "b"], 300: [], 500: ["c"]})
+
+            requests = []
+
+            def serve():
+                while True:
+                    request = self.server.recv_json()
+                    if not request:
+                        break
+                    requests.append(request[Key.SIZES])
+                    self.server.send_json(server._handle_req_sizes(request))
+
+            thread = threading.Thread(target=serve)
+            thread.start()
+
+            # 每批最多两个 size，服务器只回复存在文件的 size
+            with mock.patch.object(scanner, "SIZE_BATCH", 2):
+                server_files = client._inquire_sizes(
+                    self.client, [100, 200, 300, 400, 500]
+                )
+            self._client_socket.shutdown(socket.SHUT_WR)
+            thread.join()
+            server._db.close()
+            client._db.close()
+
+        self.assertEqual([[100, 200], [300, 400], [500]], requests)
+        self.assertEqual({200: 2, 500: 1}, server_files)
+
+    def test_loopback_messanger(self):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            if request[Key.SIZE] < 0:
+                return None
+            return {
+                Key.REQUEST_ID: request[Key.REQUEST_ID],
+                Key.RESULT: request[Key.SIZE],
+            }
+
+        # 回复在发送时已经生成，消息对象不经过编码
+        messanger = LoopbackMessanger("client", handler, False)
+        pipeline = Pipeline(messanger, 2)
+        echoes = []
+        for i in range(2):
+            pipeline.send(
+                {Key.REQUEST_ID: f"r{i}", Key.SIZE: i},
+                lambda echo: echoes.append(echo[Key.RESULT]),
+            )
+        self.assertTrue(messanger.buffered)
+
+        while pipeline.pending > 0:
+            self.assertTrue(pipeline.poll())
+        self.assertEqual([0, 1], echoes)
+        self.assertFalse(messanger.buffered)
+        self.assertEqual(0, messanger.bytes_sent)
+
+        # handler 没有回复时视为连接断开
+        self.assertFalse(messanger.send_json({Key.REQUEST_ID: "r", Key.SIZE: -1}))
+        self.assertIsNone(messanger.recv_json())
+        self.assertEqual(3, len(requests))
+
+    def test_compressors(self):
+        data = b"sweeper " * 10000
+        for compressor in COMPRESSORS.values():
+            packed = compressor.compress(data)
+            self.assertLess(len(packed), len(data))
+            self.assertEqual(data, compressor.decompress(packed, len(data)))
+            with self.assertRaises(ValueError):
+                compressor.decompress(packed, len(data) // 2)
+
+    def test_partial_header(self):
+        raw = CODECS["json"].encode({Key.REQUEST_ID: "r"})
+        frame = struct.pack("!I", len(raw)) + raw
+
+        # 帧头和消息体逐字节到达
+        def send_slowly():
+            for i in range(len(frame)):
+                self._server_socket.sendall(frame[i : i + 1])
+                time.sleep(0.001)
+
+        thread = threading.Thread(target=send_slowly)
+        thread.start()
+        self.assertEqual({"request_id": "r"}, self.client.recv_json())
+        thread.join()
+
+    def test_max_frame(self):
+        client = Messanger("client", self._client_socket, False, max_frame=1024)
+        self._server_socket.sendall(struct.pack("!I", 1025) + b"x" * 1025)
+        self.assertIsNone(client.recv_json())
+
+    def test_frame_under_max(self):
+        client = Messanger("client", self._client_socket, False, max_frame=1024)
+        padding = 1024 - len(CODECS["json"].encode({Key.REQUEST_ID: ""}))
+        raw = CODECS["json"].encode({Key.REQUEST_ID: "x" * padding})
+        self.assertEqual(1024, len(raw))
+
+        self._server_socket.sendall(struct.pack("!I", len(raw)) + raw)
+        self.assertEqual("x" * padding, client.recv_json()[Key.REQUEST_ID])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+from src.partition import Partitioner
+
+
+class TestPartitioner(unittest.TestCase):
+    def setUp(self):
+        # key: path, value: 各分段的 hash
+        self.blocks = {
+            "/a/1": ["h", "m1", "m2", "t"],
+            "/a/2": ["h", "m1", "m2", "t"],
+            "/a/3": ["h", "m1", "m2", "x"],
+            "/a/4": ["y", "m1", "m2", "t"],
+            "/a/5": ["h", "m1", "z", "t"],
+            "/a/6": ["h", "m1", "m2", "t"],
+        }
+        self.hashed = []
+
+    def _block_hash(self, path: str, serial: int):
+        self.hashed.append((path, serial))
+        return self.blocks[path][serial - 1]
+
+    def test_split(self):
+        partitioner = Partitioner(4, self._block_hash)
+        self.assertEqual([1, 4, 2, 3], partitioner.stages)
+
+        self.assertEqual(
+            [["/a/1", "/a/2", "/a/6"]],
+            list(partitioner.split(sorted(self.blocks))),
+        )
+
+        # 每个分段最多计算一次，首块不同的文件只计算首块，尾块不同的文件不计算中间分段
+        self.assertEqual(len(self.hashed), len(set(self.hashed)))
+        self.assertEqual(
+            [1], [serial for path, serial in self.hashed if "/a/4" == path]
+        )
+        self.assertEqual(
+            [1, 4], [serial for path, serial in self.hashed if "/a/3" == path]
+        )
+
+    def test_error(self):
+        # 读取失败的文件不参与比较
+        self.blocks["/a/2"] = [None] * 4
+        partitioner = Partitioner(1, self._block_hash)
+
+        self.assertEqual(
+            [["/a/1", "/a/3", "/a/5", "/a/6"]],
+            list(partitioner.split(sorted(self.blocks))),
+        )
+        self.assertEqual([], list(partitioner.split(["/a/1"])))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from src.hash_db import HashDB
+from src.prehash import PreHasher
+
+
+class TestPreHasher(unittest.TestCase):
+    def setUp(self):
+        self._dir_temp = tempfile.mkdtemp(prefix="prehash_")
+        self._db_path = os.path.join(self._dir_temp, "hash.db")
+
+        self.hashed = []
+        self._done = threading.Event()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir_temp)
+
+    def _create_files(self, size: int, count: int):
+        files = []
+        for i in range(count):
+            path = os.path.join(self._dir_temp, f"{size}-{i}.bin")
+            with open(path, "wb") as f:
+                f.write(os.urandom(size))
+            files.append(path)
+
+        return files
+
+    def _on_hashed(self, path: str, size: int, hash: str):
+        self.hashed.append(path)
+        if 5 == len(self.hashed):
+            self._done.set()
+
+    def test_warm_up(self):
+        size_group = {
+            100: self._create_files(100, 2),
+            200: self._create_files(200, 3),
+            300: self._create_files(300, 1),
+        }
+        prehasher = PreHasher(self._db_path, on_hashed=self._on_hashed)
+
+        # 处理请求期间不进行预热
+        with prehasher.hold():
+            prehasher.start()
+            prehasher.warm_up(size_group)
+            time.sleep(0.2)
+            self.assertEqual([], self.hashed)
+
+        self.assertTrue(self._done.wait(5))
+
+        # 文件多的 size group 优先，只有一个文件的 size group 不预热
+        self.assertEqual(size_group[200] + size_group[100], self.hashed)
+
+        db = HashDB(self._db_path)
+        for path in size_group[200]:
+            _, chunk_hashes = db.get_file_details(
+                path=path, size=200, mtime=os.stat(path).st_mtime
+            )
+            self.assertEqual(1, len(chunk_hashes))
+        db.close()
+
+    def test_file_lock(self):
+        path = self._create_files(100, 1)[0]
+        lock = threading.Lock()
+        locked = []
+
+        def file_lock(path: str):
+            locked.append(path)
+            return lock
+
+        prehasher = PreHasher(
+            self._db_path, on_hashed=self._on_hashed, file_lock=file_lock
+        )
+        prehasher.start()
+
+        # 服务器正在处理该文件时等待，不同时写入 HashDB
+        with lock:
+            prehasher.submit(path)
+            time.sleep(0.2)
+            self.assertEqual([path], locked)
+            self.assertEqual([], self.hashed)
+
+        for _ in range(50):
+            if self.hashed:
+                break
+            time.sleep(0.1)
+        self.assertEqual([path], self.hashed)
+
+
+if __name__ == "__main__":
+    unittest.main()
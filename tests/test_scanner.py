@@ -0,0 +1,249 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import yaml
+
+from scanner import Link, Probe, Scanner, _split_limit
+from src import BLOCK_SIZE, HEAD_SIZE, ChunkHash, Key, LoopbackMessanger, MessageBuilder
+
+
+class TestScanner(unittest.TestCase):
+    def setUp(self):
+        self._dir_temp = tempfile.mkdtemp(prefix="scanner_")
+        self._dir_data = os.path.join(self._dir_temp, "data")
+        os.makedirs(self._dir_data)
+
+        self._yaml = os.path.join(self._dir_temp, "scanner.yaml")
+        with open(self._yaml, "w", encoding="utf-8") as f:
+            yaml.safe_dump(
+                {
+                    "id": "test",
+                    "server": "127.0.0.1:5555",
+                    "hash_db": os.path.join(self._dir_temp, "hash.db"),
+                    "journal": os.path.join(self._dir_temp, "test.journal.json"),
+                    "sweep_dirs": [self._dir_data],
+                },
+                f,
+            )
+
+        self._scanners = []
+
+    def tearDown(self):
+        for scanner in self._scanners:
+            for link in scanner._links:
+                link.messanger.close()
+            scanner._stat.close_report()
+            if scanner._prefetcher:
+                scanner._prefetcher.shutdown()
+            scanner._db.close()
+
+        shutil.rmtree(self._dir_temp)
+
+    def _create_file(self, name: str, data: bytes) -> str:
+        path = os.path.join(self._dir_data, name)
+        with open(path, "wb") as f:
+            f.write(data)
+
+        return path
+
+    def _scanner(self, *, limit=(0, 0), local_mode=True, **kwargs) -> Scanner:
+        scanner = Scanner(
+            self._yaml, local_mode=local_mode, debug_mode=False, limit=limit, **kwargs
+        )
+        self._scanners.append(scanner)
+
+        # 记录扫描端计算过首块 hash 的文件
+        scanner.hashed = []
+        block_hash = scanner._ch.block_hash
+
+        def _block_hash(*, path: str, serial: int):
+            scanner.hashed.append((path, serial))
+            return block_hash(path=path, serial=serial)
+
+        scanner._ch.block_hash = _block_hash
+
+        return scanner
+
+    def test_limit_scan(self):
+        for i in range(8):
+            self._create_file(f"{i}.bin", os.urandom(1000))
+
+        scanner = self._scanner(limit=(0, 3), in_process=True)
+        scanner.start()
+
+        self.assertEqual(3, scanner._stat.scaned)
+        self.assertLessEqual(len({path for path, _ in scanner.hashed}), 3)
+
+    def test_workers_empty(self):
+        # 只有 0 字节文件时 size group 为空，不启动 worker 进程
+        self._create_file("0.bin", b"")
+
+        scanner = self._scanner(in_process=True, workers=2)
+        scanner.start()
+        self.assertEqual({}, scanner._stat.size_group)
+        self.assertEqual(0, scanner._stat.scaned)
+
+    def test_partition_limit(self):
+        # 两组首块不同的重复文件，每个文件有两个分段
+        for name in ("a", "b"):
+            data = os.urandom(HEAD_SIZE + 100)
+            for i in range(2):
+                self._create_file(f"{name}{i}.bin", data)
+
+        scanner = self._scanner(limit=(1, 0), partition=True)
+        scanner.start()
+
+        # 达到删除数量限制后，其余的桶不再计算尾块
+        self.assertEqual(1, scanner._stat.deleted)
+        self.assertEqual(6, len(scanner.hashed))
+        self.assertEqual(
+            ["a0.bin", "a1.bin"],
+            sorted(
+                os.path.basename(path) for path, serial in scanner.hashed if 2 == serial
+            ),
+        )
+
+    def test_partition_limit_scan(self):
+        data = os.urandom(1000)
+        for i in range(5):
+            self._create_file(f"{i}.bin", data)
+
+        # 只比较扫描数量限制以内的文件
+        scanner = self._scanner(limit=(0, 3), partition=True)
+        scanner.start()
+        self.assertEqual(3, scanner._stat.scaned)
+        self.assertEqual(3, len({path for path, _ in scanner.hashed}))
+
+    def test_partition_local_mode(self):
+        data = os.urandom(1000)
+        for i in range(2):
+            self._create_file(f"{i}.bin", data)
+
+        # 分桶模式只比较本机的文件，没有 --local 时同样按本地模式扫描
+        scanner = self._scanner(local_mode=False, partition=True)
+        self.assertTrue(scanner._local_mode)
+        scanner.start()
+        self.assertEqual(1, scanner._stat.deleted)
+
+    def test_resume(self):
+        for size in (100, 200, 300):
+            data = os.urandom(size)
+            for name in ("a", "b"):
+                self._create_file(f"{size}{name}.bin", data)
+        report = os.path.join(self._dir_temp, "duplicate.jsonl")
+        journal = os.path.join(self._dir_temp, "test.journal.json")
+
+        # 第二个重复文件达到删除数量的限制，size group 200 没有完成
+        scanner = self._scanner(limit=(2, 0), in_process=True, report="jsonl")
+        scanner._report = report
+        scanner.start()
+        with mock.patch.object(scanner, "_flush_stat"):
+            scanner.stop()
+
+        with open(journal, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        self.assertEqual([300], checkpoint["sizes_done"])
+        self.assertEqual(1, checkpoint["stat"]["deleted"])
+        with open(report, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        self.assertEqual(2, len(lines))
+        self.assertEqual(len(lines[0].encode("utf-8")), checkpoint["report_offset"])
+
+        # 恢复时跳过已完成的 size group，报告截断到 checkpoint 的位置
+        scanner = self._scanner(in_process=True, report="jsonl", resume=True)
+        with mock.patch.object(scanner, "_shrink", wraps=scanner._shrink) as shrink:
+            scanner.start()
+        self.assertEqual(
+            [200, 100],
+            [os.path.getsize(call.args[0][0]) for call in shrink.call_args_list],
+        )
+        scanner._stat.close_report()
+
+        with open(report, "r", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([300, 200, 100], [record["size"] for record in records])
+        self.assertEqual(3, scanner._stat.deleted)
+        self.assertFalse(os.path.exists(journal))
+
+    def test_prefetch(self):
+        # 三个分段的稀疏文件
+        path = os.path.join(self._dir_data, "1.bin")
+        with open(path, "wb") as f:
+            f.truncate(HEAD_SIZE + BLOCK_SIZE + 100)
+
+        scanner = self._scanner()
+        # 只有一个预取线程，gate 占用线程时之后提交的预取保持等待
+        scanner._prefetcher.shutdown()
+        scanner._prefetcher = ThreadPoolExecutor(max_workers=1)
+        gate = threading.Event()
+
+        probe = Probe(
+            path=path,
+            fstat=os.stat(path),
+            request_id=scanner._request_id(path),
+            blocks=3,
+        )
+        probe.chunk_hashes = [
+            {
+                "serial": 1,
+                "block_size": HEAD_SIZE,
+                "hash": ChunkHash().block_hash(path=path, serial=1)[0],
+            }
+        ]
+
+        # 服务器依次要求重发、确认已有分段匹配、确认文件唯一
+        replies = [(path, True), (path, False), (None, False)]
+        prefetches = []
+
+        def _handler(message):
+            prefetches.append(probe.prefetch)
+            if 2 == len(prefetches):
+                scanner._prefetcher.submit(gate.wait)
+
+            result, resync = replies.pop(0)
+            return MessageBuilder().echo_hash(
+                device_id="server",
+                request_id=message[Key.REQUEST_ID],
+                path=result,
+                resync=resync,
+            )
+
+        link = Link("stub", LoopbackMessanger("server", _handler, False), 1)
+        scanner._links = [link]
+        probe.links = {link: 0}
+
+        scanner._compare_hash(probe, [link])
+        self.assertTrue(scanner._pump(drain=True))
+        cancelled = prefetches[2].cancelled()
+        gate.set()
+
+        # 重发时不再提交预取，第二个分段只计算一次并直接使用预取结果
+        self.assertIs(prefetches[0], prefetches[1])
+        self.assertEqual([(path, 2)], scanner.hashed)
+        self.assertEqual(2, len(probe.chunk_hashes))
+
+        # 文件唯一时取消尚未开始的预取
+        self.assertIsNot(prefetches[1], prefetches[2])
+        self.assertTrue(cancelled)
+        self.assertIsNone(probe.prefetch)
+        self.assertEqual([], replies)
+
+        # 进程内的服务器同步回复，不预取
+        self.assertIsNone(self._scanner(in_process=True)._prefetcher)
+
+    def test_split_limit(self):
+        # 各 worker 的限制之和等于用户的限制，0 表示不限制
+        limits = _split_limit((10, 0), 4)
+        self.assertEqual([(3, 0), (3, 0), (2, 0), (2, 0)], limits)
+        self.assertEqual([(1, 7)], _split_limit((1, 7), 1))
+        self.assertEqual(8, sum(delete for delete, _ in _split_limit((8, 0), 8)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+from src import HEAD_SIZE
+from src.schedule import SCHEDULERS, GroupEstimate
+
+GB = 1024 * 1024 * 1024
+
+
+class TestScheduler(unittest.TestCase):
+    def test_size(self):
+        groups = [GroupEstimate(size=size, files=2) for size in (10, 30, 20)]
+        self.assertEqual([30, 20, 10], SCHEDULERS["size"].order(groups))
+
+    def test_reclaim(self):
+        scheduler = SCHEDULERS["reclaim"]
+
+        # 相同大小的文件越多，越可能存在重复文件
+        pair = GroupEstimate(size=4 * GB, files=2)
+        crowd = GroupEstimate(size=4 * GB - 1, files=200)
+        self.assertGreater(scheduler.score(crowd), scheduler.score(pair))
+
+        # 已经缓存 hash 的 size group 优先
+        cached = GroupEstimate(size=HEAD_SIZE, files=2, cached=2 * HEAD_SIZE)
+        self.assertEqual(
+            [HEAD_SIZE, 4 * GB - 1, 4 * GB],
+            scheduler.order([pair, crowd, cached]),
+        )
+
+        # 服务器上没有相同大小的文件时不会释放空间
+        remote = GroupEstimate(size=GB, files=5, server_files=0)
+        self.assertEqual(0, scheduler.score(remote))
+        remote.server_files = 3
+        self.assertGreater(scheduler.score(remote), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,193 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import yaml
+
+from server import Server
+from src.chunk_hash import HEAD_SIZE, ChunkHash
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        self._dir_temp = tempfile.mkdtemp(prefix="server_")
+        self._dir_data = os.path.join(self._dir_temp, "data")
+        os.makedirs(self._dir_data)
+
+        self._yaml = os.path.join(self._dir_temp, "server.yaml")
+        self._servers = []
+
+    def tearDown(self):
+        for server in self._servers:
+            server.stop()
+            server._db.close()
+
+        shutil.rmtree(self._dir_temp)
+
+    def _server(self, **config) -> Server:
+        with open(self._yaml, "w", encoding="utf-8") as f:
+            yaml.safe_dump(
+                {
+                    "id": "test",
+                    "bind": "127.0.0.1:5555",
+                    "hash_db": os.path.join(self._dir_temp, "hash.db"),
+                    "sweep_dirs": [self._dir_data],
+                    **config,
+                },
+                f,
+            )
+
+        server = Server(self._yaml, debug_mode=False)
+        self._servers.append(server)
+
+        # 记录服务器计算过的分段，读取较慢的磁盘；gate 未设置时等待
+        server.hashed = []
+        server.gate = threading.Event()
+        server.gate.set()
+        block_hash = server._ch.block_hash
+
+        def _block_hash(*, path: str, serial: int):
+            server.hashed.append((path, serial))
+            server.gate.wait()
+            time.sleep(0.1)
+            return block_hash(path=path, serial=serial)
+
+        server._ch.block_hash = _block_hash
+
+        return server
+
+    def _create_file(self, name: str, size: int) -> str:
+        path = os.path.join(self._dir_data, name)
+        with open(path, "wb") as f:
+            f.write(os.urandom(size))
+
+        return path
+
+    def _chunk_hashes(self, path: str, blocks: int):
+        ch = ChunkHash()
+        chunk_hashes = []
+        for serial in range(1, blocks + 1):
+            hash, block_size = ch.block_hash(path=path, serial=serial)
+            chunk_hashes.append(
+                {"serial": serial, "block_size": block_size, "hash": hash}
+            )
+
+        return chunk_hashes
+
+    def test_concurrent_check_hash(self):
+        path = self._create_file("1.bin", 1000)
+        client_hash = self._chunk_hashes(path, 1)
+        server = self._server(speculate_budget=0)
+
+        # 两个客户端同时比较同一个候选文件，分段只计算一次
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda i=i: results.append(
+                    server._check_hash(
+                        f"r{i}", path, f"/client/{i}", client_hash, size=1000
+                    )
+                )
+            )
+            for i in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([True, True], results)
+        self.assertEqual([(path, 1)], server.hashed)
+
+    def test_check_hash_size(self):
+        size = HEAD_SIZE + 1000
+        path = self._create_file("1.bin", size)
+        client_hash = self._chunk_hashes(path, 1)
+        server = self._server(speculate_budget=0)
+
+        # 候选文件追加数据后首块仍然相同，大小不同时不是重复文件
+        with open(path, "ab") as f:
+            f.write(os.urandom(1000))
+        self.assertFalse(
+            server._check_hash("r", path, "/client", client_hash, size=size)
+        )
+        self.assertTrue(
+            server._check_hash("r", path, "/client", client_hash, size=size + 1000)
+        )
+
+    def test_reindex_rewritten(self):
+        path = self._create_file("1.bin", 1000)
+        old_hash = self._chunk_hashes(path, 1)
+        server = self._server(speculate_budget=0)
+        self.assertEqual(
+            [path],
+            server._index.lookup(1000, old_hash[0]["hash"], [path], server._head_hash),
+        )
+
+        # 原地改写且大小不变，再次比较时按新的首块重新索引
+        with open(path, "wb") as f:
+            f.write(os.urandom(1000))
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        new_hash = self._chunk_hashes(path, 1)
+        self.assertFalse(server._check_hash("r", path, "/client", old_hash, size=1000))
+        self.assertEqual(
+            [path],
+            server._index.lookup(1000, new_hash[0]["hash"], [path], server._head_hash),
+        )
+        self.assertEqual(
+            [],
+            server._index.lookup(1000, old_hash[0]["hash"], [path], server._head_hash),
+        )
+
+    def test_speculate(self):
+        size = HEAD_SIZE + 1000
+        paths = [self._create_file(f"{i}.bin", size) for i in range(4)]
+        # 预算只够同时计算两个尾块
+        server = self._server(speculate_budget=2500 / 1024 / 1024)
+        for path in paths:
+            self.assertTrue(
+                server._check_hash(
+                    "r", path, "/client", self._chunk_hashes(path, 1), size=size
+                )
+            )
+
+        server.gate.clear()
+        for path in paths[:3]:
+            server._speculate(path, 2, size)
+        self.assertEqual(set(paths[:2]), set(server._speculations))
+        self.assertEqual(2000, server._speculate_bytes)
+
+        # 正在被请求处理的文件不预计算
+        server.gate.set()
+        with server._file_lock(paths[3]):
+            server._speculate(paths[3], 2, size)
+        self.assertNotIn(paths[3], server._speculations)
+
+        # 请求等待预计算完成，直接使用 HashDB 中的结果
+        self.assertTrue(
+            server._check_hash(
+                "r",
+                paths[0],
+                "/client",
+                self._chunk_hashes(paths[0], 2),
+                size=size,
+                verified=1,
+            )
+        )
+        self.assertEqual(1, server.hashed.count((paths[0], 2)))
+
+        for future in list(server._speculations.values()):
+            future.result()
+        self.assertEqual({}, server._speculations)
+        self.assertEqual(0, server._speculate_bytes)
+        self.assertEqual(
+            [(path, 2) for path in paths[:2]],
+            sorted(item for item in server.hashed if 2 == item[1]),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
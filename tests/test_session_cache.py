@@ -0,0 +1,55 @@
+import unittest
+from unittest import mock
+
+from src.session_cache import SessionCache
+
+
+class TestSessionCache(unittest.TestCase):
+    def test_lru(self):
+        cache = SessionCache(max_entries=2)
+        cache.put("a", [1])
+        cache.put("b", [2])
+        self.assertEqual([1], cache.get("a"))
+
+        # b 最久未访问，被淘汰
+        cache.put("c", [3])
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual([1], cache.get("a"))
+        self.assertEqual([3], cache.get("c"))
+
+        self.assertEqual(2, len(cache))
+        self.assertEqual((3, 1, 1), (cache.hits, cache.misses, cache.evictions))
+
+    def test_ttl(self):
+        cache = SessionCache(ttl=10)
+        with mock.patch("time.monotonic", return_value=100):
+            cache.put("a", [1])
+            cache.put("b", [2])
+        with mock.patch("time.monotonic", return_value=105):
+            self.assertEqual([2], cache.get("b"))
+        with mock.patch("time.monotonic", return_value=112):
+            self.assertIsNone(cache.get("a"))
+            self.assertEqual([2], cache.get("b"))
+
+        self.assertEqual(1, cache.evictions)
+
+    def test_max_bytes(self):
+        cache = SessionCache(max_bytes=100, sizeof=len)
+        cache.put("a", "x" * 40)
+        cache.put("b", "x" * 40)
+        self.assertEqual(80, cache.nbytes)
+
+        # 条目变大后重新 put，超过上限时淘汰最久未访问的条目
+        cache.put("a", "x" * 70)
+        self.assertEqual(["a"], [key for key in "ab" if cache.get(key)])
+        self.assertEqual(70, cache.nbytes)
+
+        # 单个超过上限的条目仍然保留
+        cache.put("c", "x" * 200)
+        self.assertEqual(1, len(cache))
+        self.assertEqual("x" * 200, cache.pop("c"))
+        self.assertEqual(0, cache.nbytes)
+
+
+if __name__ == "__main__":
+    unittest.main()
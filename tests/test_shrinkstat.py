@@ -0,0 +1,251 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from src.hash_db import HashDB
+from src.shrink_stat import ShrinkStat
+
+
+class TestShrinkStat(unittest.TestCase):
+    def setUp(self):
+        self.db = HashDB(":memory:")
+        self._dir_temp = tempfile.mkdtemp(prefix="shrink_stat_")
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self._dir_temp)
+
+    def _create_file(self, path: str, size: int):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(os.urandom(size))
+
+    def _age_dirs(self):
+        # 快照只保存 mtime 稳定的目录
+        past = time.time() - 3600
+        for root, _, _ in os.walk(self._dir_temp):
+            os.utime(root, (past, past))
+
+    def _group_by_size(self) -> ShrinkStat:
+        stat = ShrinkStat()
+        stat.group_by_size([self._dir_temp], db=self.db)
+
+        return stat
+
+    def test_group_by_size_snapshot(self):
+        self._create_file(os.path.join(self._dir_temp, "a", "1.bin"), 100)
+        self._create_file(os.path.join(self._dir_temp, "a", "2.bin"), 100)
+        self._create_file(os.path.join(self._dir_temp, "b", "c", "3.bin"), 200)
+        self._create_file(os.path.join(self._dir_temp, "b", "blank.bin"), 0)
+        self._age_dirs()
+
+        stat = self._group_by_size()
+        self.assertEqual(3, stat.files_to_scan)
+        self.assertEqual(2, len(stat.size_group[100]))
+        self.assertEqual(1, len(stat.files_0bytes))
+
+        # 所有目录未变化，不再遍历
+        with mock.patch("os.scandir", wraps=os.scandir) as scandir:
+            cached = self._group_by_size()
+            self.assertEqual(0, scandir.call_count)
+        self.assertEqual(
+            {size: sorted(files) for size, files in stat.size_group.items()},
+            {size: sorted(files) for size, files in cached.size_group.items()},
+        )
+        self.assertEqual(stat.files_0bytes, cached.files_0bytes)
+
+        # 只有变化的目录重新遍历
+        self._create_file(os.path.join(self._dir_temp, "b", "c", "4.bin"), 100)
+        with mock.patch("os.scandir", wraps=os.scandir) as scandir:
+            changed = self._group_by_size()
+            self.assertEqual(1, scandir.call_count)
+        self.assertEqual(3, len(changed.size_group[100]))
+
+        # 删除的子目录快照一并清理
+        shutil.rmtree(os.path.join(self._dir_temp, "b", "c"))
+        self._age_dirs()
+        removed = self._group_by_size()
+        self.assertEqual(2, removed.files_to_scan)
+        self.assertNotIn(200, removed.size_group)
+        self.assertIsNone(
+            self.db.get_dir_snapshot(os.path.join(self._dir_temp, "b", "c"))
+        )
+
+    def test_refresh(self):
+        dir_a = os.path.join(self._dir_temp, "a")
+        self._create_file(os.path.join(dir_a, "1.bin"), 100)
+        self._create_file(os.path.join(dir_a, "2.bin"), 200)
+
+        stat = self._group_by_size()
+        stat.track()
+
+        # 新增 修改 文件
+        new_file = os.path.join(dir_a, "3.bin")
+        self._create_file(new_file, 100)
+        self.assertEqual(([new_file], []), stat.refresh(new_file))
+        self.assertEqual(([], []), stat.refresh(new_file))
+
+        self._create_file(new_file, 300)
+        self.assertEqual(([new_file], []), stat.refresh(new_file))
+        self.assertEqual([new_file], stat.size_group[300])
+        self.assertEqual(1, len(stat.size_group[100]))
+
+        # 大小不变的改写
+        self._create_file(new_file, 300)
+        os.utime(new_file, (time.time() + 10, time.time() + 10))
+        self.assertEqual(([new_file], []), stat.refresh(new_file))
+        self.assertEqual(([], []), stat.refresh(new_file))
+        self.assertEqual([new_file], stat.size_group[300])
+
+        # 遍历时记录的文件没有 mtime，收到事件时视为已变化
+        file_2 = os.path.join(dir_a, "2.bin")
+        self.assertEqual(([file_2], []), stat.refresh(file_2))
+        self.assertEqual([file_2], stat.size_group[200])
+
+        # 新增目录
+        dir_b = os.path.join(self._dir_temp, "b")
+        self._create_file(os.path.join(dir_b, "c", "4.bin"), 200)
+        updated, removed = stat.refresh(dir_b)
+        self.assertEqual([os.path.join(dir_b, "c", "4.bin")], updated)
+        self.assertEqual(2, len(stat.size_group[200]))
+        self.assertEqual(4, stat.files_to_scan)
+
+        # 删除目录
+        shutil.rmtree(dir_a)
+        updated, removed = stat.refresh(dir_a)
+        self.assertEqual([], updated)
+        self.assertEqual(3, len(removed))
+        self.assertNotIn(100, stat.size_group)
+        self.assertNotIn(300, stat.size_group)
+        self.assertEqual(1, stat.files_to_scan)
+
+    def _fill_duplicates(self, groups: int) -> ShrinkStat:
+        stat = ShrinkStat()
+        for i in range(groups):
+            stat.on_duplicate(
+                server_id="local",
+                server_path=f"/data/original/{i}.bin",
+                chunk_hashes=[{"serial": 1, "block_size": 1024, "hash": f"{i:032x}"}],
+                client_path=f"/data/copy/{i}.bin",
+                free_space=1024,
+                local_mode=True,
+            )
+
+        return stat
+
+    def test_skip_scan(self):
+        stat = self._fill_duplicates(3)
+        self.assertTrue(stat.skip_scan("/data/original/1.bin"))
+        self.assertFalse(stat.skip_scan("/data/copy/1.bin"))
+        self.assertFalse(stat.skip_scan("/data/original/3.bin"))
+
+        # 原始文件保存在 set 中，查找不随重复组的数量增长
+        stat = self._fill_duplicates(1000)
+        self.assertIsInstance(stat._files_original, set)
+        self.assertEqual(1000, len(stat._files_original))
+        self.assertTrue(stat.skip_scan("/data/original/999.bin"))
+        self.assertFalse(stat.skip_scan("/data/copy/999.bin"))
+        self.assertFalse(stat.skip_scan("/data/original/1000.bin"))
+
+    def test_checkpoint(self):
+        stat = self._fill_duplicates(3)
+        stat.on_scan(6)
+        stat.on_hash(3072)
+        stat.update_error("/data/error.bin")
+
+        # 经过 JSON 保存后恢复
+        restored = ShrinkStat()
+        restored.restore(json.loads(json.dumps(stat.checkpoint())))
+        self.assertEqual(stat.checkpoint(), restored.checkpoint())
+        self.assertEqual(
+            (3, 3072, 6), (restored.deleted, restored.hash_bytes, restored.scaned)
+        )
+        self.assertTrue(restored.skip_scan("/data/original/1.bin"))
+        self.assertEqual(stat.files_duplicate, restored.files_duplicate)
+
+        # 边界之后未完成的 size group 不保存
+        stat.mark()
+        marked = json.loads(json.dumps(stat.checkpoint()))
+        # 已有的重复组增加副本，新增重复组
+        for i, path in ((1, "/data/other/1.bin"), (9, "/data/copy/9.bin")):
+            stat.on_duplicate(
+                server_id="local",
+                server_path=f"/data/original/{i}.bin",
+                chunk_hashes=[{"serial": 1, "block_size": 1024, "hash": f"{i:032x}"}],
+                client_path=path,
+                free_space=1024,
+                local_mode=True,
+            )
+        stat.on_scan(2)
+        stat.update_error("/data/error2.bin")
+        self.assertEqual(5, stat.deleted)
+        self.assertTrue(stat.skip_scan("/data/original/9.bin"))
+        self.assertEqual(marked, stat.checkpoint(at_mark=True))
+
+    def test_merge(self):
+        # worker 的结果合并到主进程
+        stat = self._fill_duplicates(2)
+        stat.on_scan(4)
+        worker = ShrinkStat()
+        worker.use_size_group({100: ["/w/1.bin", "/w/2.bin"]})
+        self.assertEqual(2, worker.files_to_scan)
+        worker.on_duplicate(
+            server_id="local",
+            server_path="/w/1.bin",
+            chunk_hashes=[{"serial": 1, "block_size": 100, "hash": "f" * 32}],
+            client_path="/w/2.bin",
+            free_space=100,
+            local_mode=True,
+        )
+        worker.on_scan(2)
+
+        stat.merge(worker.checkpoint())
+        self.assertEqual(
+            (3, 2048 + 100, 6), (stat.deleted, stat.shrink_bytes, stat.scaned)
+        )
+        self.assertEqual(3, len(stat.files_duplicate))
+        self.assertTrue(stat.skip_scan("/w/1.bin"))
+
+    def test_report(self):
+        report = os.path.join(self._dir_temp, "duplicate.jsonl")
+        stat = ShrinkStat()
+        stat.open_report(report)
+
+        def on_duplicate(i: int):
+            stat.on_duplicate(
+                server_id="srv",
+                server_path=f"/data/original/{i}.bin",
+                chunk_hashes=[{"serial": 1, "block_size": 1024, "hash": f"{i:032x}"}],
+                client_path=f"/data/copy/{i}.bin",
+                free_space=1024,
+                local_mode=False,
+            )
+
+        on_duplicate(1)
+        offset = stat.report_offset
+        on_duplicate(2)
+
+        # 每条记录确认时立即写入，内存中不保存副本列表
+        with open(report, "r", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(
+            ["/data/copy/1.bin", "/data/copy/2.bin"],
+            [record["copy"] for record in records],
+        )
+        self.assertEqual("original@srv:/data/original/1.bin", records[0]["original"])
+        self.assertTrue(all(2 == len(v) for v in stat.files_duplicate.values()))
+        stat.close_report()
+
+        # 恢复时丢弃 checkpoint 之后的记录
+        stat.open_report(report, offset=offset)
+        stat.close_report()
+        with open(report, "r", encoding="utf-8") as f:
+            self.assertEqual(1, len(f.readlines()))
+
+
+if __name__ == "__main__":
+    unittest.main()